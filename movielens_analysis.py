@@ -1,121 +1,1188 @@
 import os
-from collections import Counter
-import pytest
+import copy
+import csv
+import hashlib
+import heapq
+import gzip
+import io
+import json
+import math
+import mmap
+import queue
+import re
+import threading
+import time
+import zipfile
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from functools import wraps
+from itertools import accumulate, chain, islice, repeat
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from operator import mul
 import sys
 
+def _counting_sort(keys):
+    counts = Counter(keys)
+    unique = array('i', sorted(counts))
+    offsets = array('q', [0])
+    next_pos = {}
+    total = 0
+    for key in unique:
+        next_pos[key] = total
+        total += counts[key]
+        offsets.append(total)
+    perm = array('q', bytes(8 * len(keys)))
+    for i, key in enumerate(keys):
+        pos = next_pos[key]
+        next_pos[key] = pos + 1
+        perm[pos] = i
+    return unique, offsets, perm
+
+def _take(column, perm):
+    return array(column.typecode, map(column.__getitem__, perm))
+
+def _copy_column(column):
+    copy = array(getattr(column, 'typecode', None) or column.format)
+    copy.frombytes(memoryview(column).cast('B'))
+    return copy
+
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+DECOMPRESS_BLOCK = 1 << 20
+DECOMPRESS_QUEUE = 8
+
+def _split_archive(path):
+    normalized = path.replace(os.sep, '/')
+    index = normalized.lower().find('.zip/')
+    if index < 0:
+        return None
+    return path[:index + 4], normalized[index + 5:]
+
+def _zip_member(archive, member):
+    with zipfile.ZipFile(archive) as zf:
+        names = zf.namelist()
+    if member in names:
+        return member
+    return next((name for name in names if name.endswith('/' + member)), None)
+
+def _find_path(path):
+    archive = _split_archive(path)
+    if archive is None:
+        return path if os.path.exists(path) else None
+    if not os.path.isfile(archive[0]):
+        return None
+    member = _zip_member(*archive)
+    return None if member is None else f"{archive[0]}/{member}"
+
+def _physical_path(path):
+    archive = _split_archive(path)
+    return path if archive is None else archive[0]
+
+def _is_plain(path):
+    return _split_archive(path) is None and not path.endswith(COMPRESSED_SUFFIXES)
+
+def _sidecar_path(path, suffix):
+    archive = _split_archive(path)
+    if archive is None:
+        return path + suffix
+    return f"{archive[0]}.{archive[1].replace('/', '.')}{suffix}"
+
+def _resolve_path(source):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    tried_paths = [source, os.path.join(os.path.pardir, source), os.path.join(script_dir, source)]
+    for candidate in tried_paths:
+        for suffix in ('',) + COMPRESSED_SUFFIXES:
+            path = _find_path(candidate + suffix)
+            if path is not None:
+                return path
+    raise FileNotFoundError(f"Не найден файл {source}. Пробовал пути: {tried_paths}")
+
+class _ThreadedReader(io.RawIOBase):
+    def __init__(self, raw, block_size=DECOMPRESS_BLOCK, depth=DECOMPRESS_QUEUE):
+        self.raw = raw
+        self.blocks = queue.Queue(depth)
+        self.pending = memoryview(b'')
+        self.eof = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(block_size,), daemon=True)
+        self.thread.start()
+    
+    def _produce(self, block_size):
+        try:
+            while not self.stopped.is_set():
+                block = self.raw.read(block_size)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._put(e)
+    
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if not self.pending:
+            if self.eof:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                self.eof = True
+                raise block
+            if not block:
+                self.eof = True
+                return 0
+            self.pending = memoryview(block)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+    
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.raw.close()
+        super().close()
+
+class _ArchiveMember(io.RawIOBase):
+    def __init__(self, archive, member):
+        self.archive = zipfile.ZipFile(archive)
+        self.member = self.archive.open(member)
+    
+    def readable(self):
+        return True
+    
+    def read(self, size=-1):
+        return self.member.read(size)
+    
+    def readinto(self, buffer):
+        return self.member.readinto(buffer)
+    
+    def close(self):
+        if not self.closed:
+            self.member.close()
+            self.archive.close()
+        super().close()
+
+def _open_compressed(path):
+    archive = _split_archive(path)
+    if archive is not None:
+        return _ArchiveMember(*archive)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception(f"Reading {path} requires the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return None
+
+def _open_path(path):
+    raw = _open_compressed(path)
+    if raw is None:
+        return open(path, 'r', encoding='utf-8', newline='')
+    return io.TextIOWrapper(io.BufferedReader(_ThreadedReader(raw), DECOMPRESS_BLOCK),
+                            encoding='utf-8', newline='')
+
+def _load_source(loader, source, cache):
+    name = type(loader).__name__
+    if not isinstance(source, str):
+        with _phase(f'{name}.parse'):
+            loader._load_data(source)
+        _count_rejected(loader)
+        return
+    path = _resolve_path(source)
+    if cache:
+        with _phase(f'{name}.snapshot_load'):
+            loaded = _load_snapshot(loader, path)
+        if loaded:
+            return
+    with _phase(f'{name}.parse'):
+        if getattr(loader, 'workers', 1) > 1 and _is_plain(path):
+            loader._load_parallel(path)
+        else:
+            with _open_path(path) as f:
+                loader._load_data(f)
+    _count(f'{name}.bytes', os.path.getsize(_physical_path(path)))
+    _count_rejected(loader)
+    if cache:
+        with _phase(f'{name}.snapshot_save'):
+            _save_snapshot(loader, path)
+
+DEFAULT_CHUNK_ROWS = 1 << 16
+RANGE_SCAN_BLOCK = 1 << 20
+COMPACT_MIN_ROWS = 1 << 16
+COMPACT_RATIO = 0.1
+RATING_ROW_BYTES = 24
+TAG_ROW_BYTES = 96
+
+def _chunk_rows(chunk_size, max_memory, row_bytes):
+    if max_memory is not None:
+        return max(1, int(max_memory) // row_bytes)
+    return chunk_size or DEFAULT_CHUNK_ROWS
+
+def _open_text(source):
+    if isinstance(source, str):
+        return _open_path(_resolve_path(source))
+    return nullcontext(source)
+
+def _rating_line_chunks(lines, chunk_size, first_line=2, where='', rejected=None):
+    chunk = (array('i'), array('i'), array('d'), array('q'))
+    user_ids, movie_ids, values, timestamps = chunk
+    for i, line in enumerate(lines):
+        parts = line.strip().split(',')
+        if len(parts) < 4:
+            if rejected is not None:
+                rejected['wrong field count'] += 1
+            continue
+        try:
+            userId, movieId, rating, timestamp = int(parts[0]), int(parts[1]), float(parts[2]), int(parts[3])
+        except ValueError as e:
+            raise Exception(f"Invalid data format in line {i+first_line}{where}: {str(e)}")
+        user_ids.append(userId)
+        movie_ids.append(movieId)
+        values.append(rating)
+        timestamps.append(timestamp)
+        if len(values) >= chunk_size:
+            yield chunk
+            chunk = (array('i'), array('i'), array('d'), array('q'))
+            user_ids, movie_ids, values, timestamps = chunk
+    if values:
+        yield chunk
+
+def _csv_rows(lines, n_fields, rejected, header=True):
+    reader = csv.reader(lines, strict=True)
+    if header:
+        try:
+            next(reader, None)
+        except csv.Error:
+            pass
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            rejected['malformed quoting'] += 1
+            continue
+        if len(row) == n_fields:
+            yield row
+        elif row:
+            rejected['wrong field count'] += 1
+
+def _tag_line_chunks(lines, chunk_size, rejected=None, header=True):
+    rejected = Counter() if rejected is None else rejected
+    chunk = (array('i'), array('i'), [], array('q'))
+    user_ids, movie_ids, tags, timestamps = chunk
+    for userId, movieId, tag, timestamp in _csv_rows(lines, 4, rejected, header):
+        try:
+            userId, movieId, timestamp = int(userId), int(movieId), int(timestamp)
+        except ValueError:
+            rejected['invalid number'] += 1
+            continue
+        user_ids.append(userId)
+        movie_ids.append(movieId)
+        tags.append(tag)
+        timestamps.append(timestamp)
+        if len(tags) >= chunk_size:
+            yield chunk
+            chunk = (array('i'), array('i'), [], array('q'))
+            user_ids, movie_ids, tags, timestamps = chunk
+    if tags:
+        yield chunk
+
+def iter_rating_chunks(source, chunk_size=None, max_memory=None, rejected=None):
+    chunk_size = _chunk_rows(chunk_size, max_memory, RATING_ROW_BYTES)
+    with _open_text(source) as file_obj:
+        next(file_obj, None)
+        yield from _rating_line_chunks(file_obj, chunk_size, rejected=rejected)
+
+def iter_tag_chunks(source, chunk_size=None, max_memory=None, rejected=None):
+    chunk_size = _chunk_rows(chunk_size, max_memory, TAG_ROW_BYTES)
+    with _open_text(source) as file_obj:
+        yield from _tag_line_chunks(file_obj, chunk_size, rejected)
+
+def tail_csv(source, offset=None, poll_interval=1.0, polls=None):
+    path = _resolve_path(source)
+    if offset is None:
+        offset = os.path.getsize(path)
+    poll = 0
+    while polls is None or poll < polls:
+        if poll:
+            time.sleep(poll_interval)
+        poll += 1
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < offset:
+                offset = 0
+            f.seek(offset)
+            if not offset:
+                f.readline()
+            data = f.read(size - f.tell())
+            end = _last_record_end(data)
+            offset = f.tell() - len(data) + end
+        yield io.StringIO(data[:end].decode('utf-8'), newline=''), offset
+
+def _last_record_end(data):
+    if b'"' not in data:
+        return data.rfind(b'\n') + 1
+    end = position = quotes = 0
+    while True:
+        newline = data.find(b'\n', position)
+        if newline < 0:
+            return end
+        quotes += data.count(b'"', position, newline)
+        position = newline + 1
+        if not quotes % 2:
+            end = position
+
+def _quoted_bounds(f, start, size, targets):
+    bounds = [start]
+    f.seek(start)
+    position = start
+    quotes = 0
+    targets = iter(targets)
+    target = next(targets, None)
+    while target is not None:
+        block = f.read(RANGE_SCAN_BLOCK)
+        if not block:
+            break
+        i = 0
+        while target is not None:
+            if position + i < target:
+                j = min(target - position, len(block))
+                quotes += block.count(b'"', i, j)
+                i = j
+                if i == len(block):
+                    break
+            newline = block.find(b'\n', i)
+            if newline < 0:
+                quotes += block.count(b'"', i)
+                break
+            quotes += block.count(b'"', i, newline)
+            i = newline + 1
+            if not quotes % 2:
+                if position + i < size:
+                    bounds.append(position + i)
+                while target is not None and target <= position + i:
+                    target = next(targets, None)
+        position += len(block)
+    return bounds
+
+def _line_bounds(f, start, size, targets):
+    bounds = [start]
+    for target in targets:
+        if target <= bounds[-1]:
+            continue
+        f.seek(target - 1)
+        f.readline()
+        if f.tell() >= size:
+            break
+        if f.tell() > bounds[-1]:
+            bounds.append(f.tell())
+    return bounds
+
+def _byte_ranges(path, parts, quoted=False):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        targets = [start + (size - start) * i // parts for i in range(1, parts)]
+        bounds = (_quoted_bounds if quoted else _line_bounds)(f, start, size, targets)
+    bounds.append(size)
+    return [(path, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return io.StringIO(f.read(end - start).decode('utf-8'), newline='')
+
+def _iter_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+def _parse_rating_range(byte_range):
+    path, start, end = byte_range
+    columns = (array('i'), array('i'), array('d'), array('q'))
+    rejected = Counter()
+    for chunk in _rating_line_chunks(_read_range(path, start, end), DEFAULT_CHUNK_ROWS, 1,
+                                     f" of bytes {start}-{end}", rejected):
+        for column, part in zip(columns, chunk):
+            column.extend(part)
+    return columns, rejected
+
+def _parse_tag_range(byte_range):
+    path, start, end = byte_range
+    columns = (array('i'), array('i'), [], array('q'))
+    rejected = Counter()
+    for chunk in _tag_line_chunks(_read_range(path, start, end), DEFAULT_CHUNK_ROWS, rejected, header=False):
+        for column, part in zip(columns, chunk):
+            column.extend(part)
+    return columns, rejected
+
+def _parse_parallel(path, parser, workers, quoted=False):
+    from concurrent.futures import ProcessPoolExecutor
+    ranges = _byte_ranges(path, workers * 4, quoted)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(parser, ranges)
+
+SNAPSHOT_MAGIC = b'MLSNAP\0\0'
+SNAPSHOT_VERSION = 7
+SNAPSHOT_HASH_BLOCK = 1 << 20
+
+def _snapshot_path(path):
+    return _sidecar_path(path, '.snapshot')
+
+def _source_key(path):
+    physical = _physical_path(path)
+    st = os.stat(physical)
+    digest = hashlib.sha1()
+    with open(physical, 'rb') as f:
+        digest.update(f.read(SNAPSHOT_HASH_BLOCK))
+        if st.st_size > SNAPSHOT_HASH_BLOCK:
+            f.seek(max(st.st_size - SNAPSHOT_HASH_BLOCK, SNAPSHOT_HASH_BLOCK))
+            digest.update(f.read())
+    key = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': digest.hexdigest()}
+    if physical != path:
+        key['member'] = _split_archive(path)[1]
+    return key
+
+def _pack_strings(strings):
+    return array('B', '\0'.join(strings).encode('utf-8'))
+
+def _unpack_strings(blob, count):
+    if not count:
+        return []
+    return bytes(blob).decode('utf-8').split('\0')
+
+def _pack_string_column(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('q', [0])
+    offsets.extend(accumulate(map(len, encoded)))
+    return array('B', b''.join(encoded)), offsets
+
+class _StringColumn:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, index):
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+    
+    def __iter__(self):
+        data = bytes(self.blob)
+        offsets = self.offsets
+        for index in range(len(offsets) - 1):
+            yield data[offsets[index]:offsets[index + 1]].decode('utf-8')
+
+class _LazyRecords:
+    def __init__(self, count, build, columns):
+        self.records = [None] * count
+        self.count = count
+        self.build = build
+        self.columns = columns
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.records)))]
+        record = self.records[index]
+        if record is None:
+            index = range(len(self.records))[index]
+            record = self.records[index] = self.build(index)
+        return record
+    
+    def __iter__(self):
+        records = self.records
+        for index, record in enumerate(records):
+            if record is None:
+                record = records[index] = self.build(index)
+            yield record
+    
+    def __eq__(self, other):
+        if isinstance(other, (list, _LazyRecords)):
+            return list(self) == list(other)
+        return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return repr(list(self))
+    
+    def append(self, record):
+        self.records.append(record)
+    
+    def column(self, name):
+        return chain(self.columns[name], (getattr(record, name) for record in self.records[self.count:]))
+
+def _record_column(records, name):
+    if isinstance(records, _LazyRecords):
+        return records.column(name)
+    return (getattr(record, name) for record in records)
+
+class _RecordIndex:
+    def __init__(self, records, positions=None):
+        self.records = records
+        self.positions = {} if positions is None else positions
+    
+    def get(self, key, default=None):
+        position = self.positions.get(key)
+        return default if position is None else self.records[position]
+    
+    def __getitem__(self, key):
+        return self.records[self.positions[key]]
+    
+    def __contains__(self, key):
+        return key in self.positions
+    
+    def __iter__(self):
+        return iter(self.positions)
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def items(self):
+        return ((key, self.records[position]) for key, position in self.positions.items())
+
+class _RecordGroups:
+    def __init__(self, records, groups=None, offsets=None, perm=None):
+        self.records = records
+        self.groups = {} if groups is None else groups
+        self.offsets = offsets
+        self.perm = perm
+    
+    def positions(self, key):
+        positions = self.groups.get(key)
+        if type(positions) is int:
+            positions = self.perm[self.offsets[positions]:self.offsets[positions + 1]]
+        return positions
+    
+    def get(self, key, default=None):
+        positions = self.positions(key)
+        return default if positions is None else list(map(self.records.__getitem__, positions))
+    
+    def __getitem__(self, key):
+        if key not in self.groups:
+            raise KeyError(key)
+        return self.get(key)
+    
+    def __contains__(self, key):
+        return key in self.groups
+    
+    def __iter__(self):
+        return iter(self.groups)
+    
+    def __len__(self):
+        return len(self.groups)
+    
+    def items(self):
+        return ((key, self.get(key)) for key in self.groups)
+    
+    def group_items(self):
+        return ((key, self.positions(key)) for key in self.groups)
+    
+    def add(self, key, position):
+        positions = self.groups.get(key)
+        if type(positions) is not list:
+            positions = self.groups[key] = [] if positions is None else list(self.positions(key))
+        positions.append(position)
+
+def _pack_counter(counter):
+    return _pack_strings(f"{key}\t{value}" for key, value in counter.items())
+
+def _unpack_counter(blob):
+    pairs = (item.rsplit('\t', 1) for item in _unpack_strings(blob, len(blob)))
+    return Counter({key: int(value) for key, value in pairs})
+
+def _write_sections(target, header, sections):
+    header = dict(header, version=SNAPSHOT_VERSION, byteorder=sys.byteorder, sections=[])
+    offset = 0
+    for name, column in sections.items():
+        nbytes = len(column) * column.itemsize
+        header['sections'].append({'name': name, 'typecode': column.typecode,
+                                   'offset': offset, 'length': len(column)})
+        offset += nbytes + (-nbytes) % 8
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * ((-len(header_bytes)) % 8)
+    tmp_path = target + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for column in sections.values():
+                column.tofile(f)
+                f.write(b'\0' * ((-len(column) * column.itemsize) % 8))
+        os.replace(tmp_path, target)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+def _read_sections(target, **expected):
+    try:
+        with open(target, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            header_len = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_len))
+            if (header.get('version') != SNAPSHOT_VERSION
+                    or header.get('byteorder') != sys.byteorder
+                    or any(header.get(key) != value for key, value in expected.items())):
+                return None
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    base = len(SNAPSHOT_MAGIC) + 8 + header_len
+    view = memoryview(mapped)
+    sections = {}
+    for section in header['sections']:
+        start = base + section['offset']
+        nbytes = section['length'] * array(section['typecode']).itemsize
+        sections[section['name']] = view[start:start + nbytes].cast(section['typecode'])
+    return header, sections, mapped
+
+def _save_snapshot(loader, path):
+    header = {'kind': type(loader).__name__, 'source': _source_key(path)}
+    return _write_sections(_snapshot_path(path), header, loader._snapshot_sections())
+
+def _load_snapshot(loader, path):
+    if not os.path.exists(_snapshot_path(path)):
+        return False
+    try:
+        source = _source_key(path)
+    except OSError:
+        return False
+    loaded = _read_sections(_snapshot_path(path), kind=type(loader).__name__, source=source)
+    if loaded is None:
+        return False
+    _, sections, loader._snapshot = loaded
+    loader._restore_snapshot(sections)
+    return True
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+def _copy_result(value):
+    if isinstance(value, list):
+        return [_copy_result(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _copy_result(item) for key, item in value.items()}
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+class QueryCache:
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def lookup(self, key, version, compute):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            now = self.clock() if self.ttl is not None else None
+            entry = self.entries.get(key)
+            if entry is not None and (now is None or now - entry[1] <= self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            if version == self.version:
+                self.entries[key] = (value, now)
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'version': self.version}
+
+LATENCY_BUCKETS = 32
+
+class Profiler:
+    def __init__(self):
+        self.phases = {}
+        self.counters = Counter()
+        self.latencies = {}
+    
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+    
+    def add_time(self, name, seconds):
+        entry = self.phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+    
+    def count(self, name, value=1):
+        self.counters[name] += value
+    
+    def observe(self, name, seconds):
+        histogram = self.latencies.get(name)
+        if histogram is None:
+            histogram = self.latencies[name] = array('q', bytes(8 * LATENCY_BUCKETS))
+        histogram[min(int(seconds * 1e6).bit_length(), LATENCY_BUCKETS - 1)] += 1
+    
+    def _percentile(self, histogram, fraction):
+        target = max(sum(histogram) * fraction, 1)
+        total = 0
+        for bucket, count in enumerate(histogram):
+            total += count
+            if total >= target:
+                return 1 << bucket
+        return 1 << (LATENCY_BUCKETS - 1)
+    
+    def summary(self):
+        lines = [f"{'phase':<32} {'calls':>8} {'total ms':>12}"]
+        for name, (calls, seconds) in sorted(self.phases.items()):
+            lines.append(f"{name:<32} {calls:>8} {seconds * 1000:>12.2f}")
+        if self.counters:
+            lines.append(f"{'counter':<32} {'value':>21}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<32} {value:>21}")
+        for name, value in sorted(self.counters.items()):
+            loader = name[:-len('.bytes')]
+            if name.endswith('.bytes') and self.phases.get(f'{loader}.parse', (0, 0.0))[1]:
+                rate = value / self.phases[f'{loader}.parse'][1] / 1e6
+                lines.append(f"{loader + ' MB/s':<32} {rate:>21.1f}")
+        if self.latencies:
+            lines.append(f"{'query':<32} {'calls':>8} {'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+            for name, histogram in sorted(self.latencies.items()):
+                top = max(bucket for bucket, count in enumerate(histogram) if count)
+                lines.append(f"{name:<32} {sum(histogram):>8} {self._percentile(histogram, 0.5):>8} "
+                             f"{self._percentile(histogram, 0.99):>8} {1 << top:>8}")
+        return lines
+
+_profiler = None
+
+def start_profiling():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+def stop_profiling():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+def _phase(name):
+    return nullcontext() if _profiler is None else _profiler.phase(name)
+
+def _count(name, value=1):
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+def _count_rejected(loader):
+    if _profiler is not None:
+        name = type(loader).__name__
+        _profiler.count(f'{name}.rows', loader._row_count())
+        _profiler.count(f'{name}.skipped', sum(getattr(loader, 'rejected', Counter()).values()))
+
+def cached_query(method):
+    name = method.__name__
+    qualname = method.__qualname__
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (name, _freeze(args), _freeze(kwargs))
+        if _profiler is None:
+            return _copy_result(self.query_cache.lookup(key, self._cache_version(), lambda: method(self, *args, **kwargs)))
+        start = time.perf_counter()
+        try:
+            return _copy_result(self.query_cache.lookup(key, self._cache_version(), lambda: method(self, *args, **kwargs)))
+        finally:
+            _profiler.observe(qualname, time.perf_counter() - start)
+    return wrapper
+
+def _timed(method):
+    qualname = method.__qualname__
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return method(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _profiler.observe(qualname, time.perf_counter() - start)
+    return wrapper
+
+class _Record:
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def keys(self):
+        return self.__slots__
+    
+    def _asdict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+    
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+    
+    def __hash__(self):
+        return hash(tuple(getattr(self, key) for key in self.__slots__))
+    
+    def __repr__(self):
+        fields = ', '.join(f"{key}={getattr(self, key)!r}" for key in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+class Movie(_Record):
+    __slots__ = ('movieId', 'title', 'genres', 'year', 'genre_mask')
+    
+    def __init__(self, movieId, title, genres, year, genre_mask):
+        self.movieId = movieId
+        self.title = title
+        self.genres = genres
+        self.year = year
+        self.genre_mask = genre_mask
+
+class Link(_Record):
+    __slots__ = ('movieId', 'imdbId', 'tmdbId')
+    
+    def __init__(self, movieId, imdbId, tmdbId):
+        self.movieId = movieId
+        self.imdbId = imdbId
+        self.tmdbId = tmdbId
+
+class Tag(_Record):
+    __slots__ = ('userId', 'movieId', 'tag', 'timestamp')
+    
+    def __init__(self, userId, movieId, tag, timestamp):
+        self.userId = userId
+        self.movieId = movieId
+        self.tag = tag
+        self.timestamp = timestamp
+
+def _bitmap(positions):
+    positions = list(positions)
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+def _bitmap_positions(bitmap):
+    bits = bin(bitmap)[:1:-1]
+    positions = []
+    position = bits.find('1')
+    while position >= 0:
+        positions.append(position)
+        position = bits.find('1', position + 1)
+    return positions
+
+def _year_bounds(years):
+    if isinstance(years, str) and '-' in years.strip('-'):
+        years = years.split('-', 1)
+    if isinstance(years, (int, str)):
+        years = (years, years)
+    return int(years[0]), int(years[1])
+
 class Movies:
-    def __init__(self, source):
+    def __init__(self, source, cache=False):
+        self.version = 0
+        self.query_cache = QueryCache()
         self.movies = []
         self.years = set()
+        self.movieid_to_movie = _RecordIndex(self.movies)
+        self._title_to_movie = None
+        self._year_to_movies = None
+        self._genre_to_movies = None
+        self._facets = None
+        self.genre_codes = {}
+        self.genre_names = []
+        self.rejected = Counter()
         try:
-            if isinstance(source, str):
-                import os
-                tried_paths = [source]
-                f = None
-                try:
-                    f = open(source, 'r', encoding='utf-8')
-                except FileNotFoundError:
-                    alt_path = os.path.join(os.path.pardir, source)
-                    tried_paths.append(alt_path)
-                    try:
-                        f = open(alt_path, 'r', encoding='utf-8')
-                    except FileNotFoundError:
-                        script_dir = os.path.dirname(os.path.abspath(__file__))
-                        alt_path2 = os.path.join(script_dir, source)
-                        tried_paths.append(alt_path2)
-                        try:
-                            f = open(alt_path2, 'r', encoding='utf-8')
-                        except FileNotFoundError:
-                            raise FileNotFoundError(f"Не найден файл {source}. Пробовал пути: {tried_paths}")
-                with f:
-                    self._load_data(f)
-            else:
-                self._load_data(source)
+            _load_source(self, source, cache)
         except (IOError, OSError) as e:
             raise Exception(f"Failed to load movies data: {str(e)}")
     
     def _load_data(self, file_obj):
         try:
-            next(file_obj)
-            for i, line in enumerate(file_obj):
-                try:
-                    parts = line.strip().split(',', 2)
-                    if len(parts) < 3:
-                        continue
-                    movieId, title, genres = parts
-                    year = None
-                    if '(' in title and ')' in title:
-                        y = title.split('(')[-1].split(')')[0]
-                        if y.isdigit():
-                            year = y
-                            self.years.add(int(year))
-                    self.movies.append({
-                        'movieId': movieId,
-                        'title': title,
-                        'genres': genres,
-                        'year': year
-                    })
-                except ValueError as e:
-                    raise Exception(f"Invalid data format in line {i+2}: {str(e)}")
+            for movieId, title, genres in _csv_rows(file_obj, 3, self.rejected):
+                if not movieId.isdigit():
+                    self.rejected['invalid movieId'] += 1
+                    continue
+                self._add_movie(int(movieId), title, genres)
         except Exception as e:
             raise Exception(f"Error loading movies data: {str(e)}")
     
+    def _row_count(self):
+        return len(self.movies)
+    
+    def _genre_code(self, genre):
+        code = self.genre_codes.get(genre)
+        if code is None:
+            code = self.genre_codes[sys.intern(genre)] = len(self.genre_names)
+            self.genre_names.append(sys.intern(genre))
+        return code
+    
+    def genre_mask(self, genres):
+        if isinstance(genres, str):
+            genres = [genres]
+        mask = 0
+        for genre in genres:
+            code = self.genre_codes.get(genre)
+            if code is None:
+                return None
+            mask |= 1 << code
+        return mask
+    
+    def _parse_genres(self, genres):
+        genre_mask = 0
+        genre_names = []
+        for genre in genres.split('|'):
+            code = self._genre_code(genre)
+            genre_mask |= 1 << code
+            genre_names.append(self.genre_names[code])
+        return tuple(genre_names), genre_mask
+    
+    def _add_movie(self, movieId, title, genres):
+        year = None
+        if '(' in title and ')' in title:
+            y = title.split('(')[-1].split(')')[0]
+            if y.isdigit():
+                year = int(y)
+                self.years.add(year)
+        genre_names, genre_mask = self._parse_genres(genres)
+        movie = Movie(movieId, title, genre_names, year, genre_mask)
+        self.version += 1
+        position = len(self.movies)
+        self.movies.append(movie)
+        self.movieid_to_movie.positions.setdefault(movieId, position)
+        if self._title_to_movie is not None:
+            self._title_to_movie.positions.setdefault(title.lower(), position)
+        if self._year_to_movies is not None and year is not None:
+            self._year_to_movies.setdefault(year, []).append(movie)
+        if self._genre_to_movies is not None:
+            for genre in movie.genres:
+                self._genre_to_movies.setdefault(genre, []).append(movie)
+        if self._facets is not None:
+            self._add_facets(position, movie)
+    
+    @property
+    def title_to_movie(self):
+        if self._title_to_movie is None:
+            positions = {}
+            for position, title in enumerate(_record_column(self.movies, 'title')):
+                positions.setdefault(title.lower(), position)
+            self._title_to_movie = _RecordIndex(self.movies, positions)
+        return self._title_to_movie
+    
+    @property
+    def year_to_movies(self):
+        if self._year_to_movies is None:
+            index = {}
+            for movie in self.movies:
+                if movie.year is not None:
+                    index.setdefault(movie.year, []).append(movie)
+            self._year_to_movies = index
+        return self._year_to_movies
+    
+    @property
+    def genre_to_movies(self):
+        if self._genre_to_movies is None:
+            index = {}
+            for movie in self.movies:
+                for genre in movie.genres:
+                    index.setdefault(genre, []).append(movie)
+            self._genre_to_movies = index
+        return self._genre_to_movies
+    
+    def _snapshot_sections(self):
+        titles, title_offsets = _pack_string_column(m.title for m in self.movies)
+        genres, genre_offsets = _pack_string_column('|'.join(m.genres) for m in self.movies)
+        return {'movieId': array('i', (m.movieId for m in self.movies)),
+                'title': titles, 'titleOffsets': title_offsets,
+                'genres': genres, 'genreOffsets': genre_offsets,
+                'year': array('i', (m.year or 0 for m in self.movies)),
+                'genreNames': _pack_strings(self.genre_names),
+                'rejected': _pack_counter(self.rejected)}
+    
+    def _restore_snapshot(self, sections):
+        self.version += 1
+        self.rejected = _unpack_counter(sections['rejected'])
+        self.genre_names = [sys.intern(genre) for genre in _unpack_strings(sections['genreNames'], len(sections['genreNames']))]
+        self.genre_codes = {genre: code for code, genre in enumerate(self.genre_names)}
+        ids, years = sections['movieId'], sections['year']
+        titles = _StringColumn(sections['title'], sections['titleOffsets'])
+        genres = _StringColumn(sections['genres'], sections['genreOffsets'])
+        self.years = set(years)
+        self.years.discard(0)
+        def build(position):
+            genre_names, genre_mask = self._parse_genres(genres[position])
+            return Movie(ids[position], titles[position], genre_names, years[position] or None, genre_mask)
+        count = len(ids)
+        self.movies = _LazyRecords(count, build, {'movieId': ids, 'title': titles})
+        self.movieid_to_movie = _RecordIndex(self.movies, dict(zip(ids[::-1], range(count - 1, -1, -1))))
+    
+    def get_facets(self):
+        if self._facets is None:
+            genres, years, decades, positions = {}, {}, {}, {}
+            for position, movie in enumerate(self.movies):
+                positions.setdefault(movie.movieId, position)
+                for genre in movie.genres:
+                    genres.setdefault(genre, []).append(position)
+                if movie.year is not None:
+                    years.setdefault(movie.year, []).append(position)
+                    decades.setdefault(movie.year // 10 * 10, []).append(position)
+            self._facets = {'genre': {key: _bitmap(value) for key, value in genres.items()},
+                            'year': {key: _bitmap(value) for key, value in years.items()},
+                            'decade': {key: _bitmap(value) for key, value in decades.items()},
+                            'position': positions}
+        return self._facets
+    
+    def _add_facets(self, position, movie):
+        facets = self._facets
+        facets['position'].setdefault(movie.movieId, position)
+        bit = 1 << position
+        for genre in movie.genres:
+            facets['genre'][genre] = facets['genre'].get(genre, 0) | bit
+        if movie.year is not None:
+            facets['year'][movie.year] = facets['year'].get(movie.year, 0) | bit
+            decade = movie.year // 10 * 10
+            facets['decade'][decade] = facets['decade'].get(decade, 0) | bit
+    
+    def facet_bitmap(self, genres=None, years=None, decades=None):
+        facets = self.get_facets()
+        bitmap = (1 << len(self.movies)) - 1
+        if genres is not None:
+            for genre in [genres] if isinstance(genres, str) else genres:
+                bitmap &= facets['genre'].get(genre, 0)
+        if years is not None:
+            first, last = _year_bounds(years)
+            selected = 0
+            for year, bits in facets['year'].items():
+                if first <= year <= last:
+                    selected |= bits
+            bitmap &= selected
+        if decades is not None:
+            selected = 0
+            for decade in [decades] if isinstance(decades, (int, str)) else decades:
+                selected |= facets['decade'].get(int(decade) // 10 * 10, 0)
+            bitmap &= selected
+        return bitmap
+    
+    def movies_from_bitmap(self, bitmap):
+        return list(map(self.movies.__getitem__, _bitmap_positions(bitmap)))
+    
+    @_timed
+    def filter_movies(self, genres=None, years=None, decades=None):
+        return self.movies_from_bitmap(self.facet_bitmap(genres, years, decades))
+    
+    @_timed
+    def count_movies(self, genres=None, years=None, decades=None):
+        return self.facet_bitmap(genres, years, decades).bit_count()
+    
     def get_movies(self):
         return self.movies
     
+    @_timed
     def get_movie(self, movie_id):
-        for movie in self.movies:
-            if str(movie['movieId']) == str(movie_id):
-                return movie
-        return None
+        try:
+            return self.movieid_to_movie.get(int(movie_id), None)
+        except (TypeError, ValueError):
+            return None
     
+    @_timed
     def get_movie_by_title(self, title):
-        for movie in self.movies:
-            if movie['title'].lower() == title.lower():
-                return movie
-        return None
+        return self.title_to_movie.get(title.lower(), None)
     
+    @_timed
+    def get_movies_by_year(self, year):
+        try:
+            return self.year_to_movies.get(int(year), [])
+        except (TypeError, ValueError):
+            return []
+    
+    @_timed
+    def get_movies_by_genre(self, genre):
+        return self.genre_to_movies.get(genre, [])
+    
+    def _cache_version(self):
+        return self.version
+    
+    @cached_query
     def get_genres(self):
-        genres = set()
-        for movie in self.movies:
-            genres.update(movie['genres'].split('|'))
-        return sorted(list(genres))
+        return sorted(self.genre_to_movies)
     
     def get_year_range(self):
         if self.years:
             return min(self.years), max(self.years)
         return None, None
 
+IMDB_URL = "https://www.imdb.com/title/tt{}/"
+TMDB_URL = "https://www.themoviedb.org/movie/{}"
+
 class Links:
-    def __init__(self, source, movies_obj):
+    def __init__(self, source, movies_obj, cache=False):
         self.links = []
         self.movies_obj = movies_obj
-        self.movieid_to_link = {}
-        self.title_to_link = {}
+        self.movieid_to_link = _RecordIndex(self.links)
+        self._title_to_link = None
+        self.rejected = Counter()
         try:
-            if isinstance(source, str):
-                import os
-                tried_paths = [source]
-                f = None
-                try:
-                    f = open(source, 'r', encoding='utf-8')
-                except FileNotFoundError:
-                    alt_path = os.path.join(os.path.pardir, source)
-                    tried_paths.append(alt_path)
-                    try:
-                        f = open(alt_path, 'r', encoding='utf-8')
-                    except FileNotFoundError:
-                        script_dir = os.path.dirname(os.path.abspath(__file__))
-                        alt_path2 = os.path.join(script_dir, source)
-                        tried_paths.append(alt_path2)
-                        try:
-                            f = open(alt_path2, 'r', encoding='utf-8')
-                        except FileNotFoundError:
-                            raise FileNotFoundError(f"Не найден файл {source}. Пробовал пути: {tried_paths}")
-                with f:
-                    self._load_data(f)
-            else:
-                self._load_data(source)
+            _load_source(self, source, cache)
         except (IOError, OSError) as e:
             raise Exception(f"Failed to load links data: {str(e)}")
     
@@ -126,434 +1193,2228 @@ class Links:
                 try:
                     parts = line.strip().split(',')
                     if len(parts) < 3:
+                        self.rejected['wrong field count'] += 1
                         continue
                     movieId, imdbId, tmdbId = parts
-                    link = {'movieId': movieId, 'imdbId': imdbId, 'tmdbId': tmdbId}
-                    self.links.append(link)
-                    self.movieid_to_link[movieId] = link
-                    movie = self.movies_obj.get_movie(movieId)
-                    if movie:
-                        self.title_to_link[movie['title'].lower()] = link
+                    self._add_link(int(movieId), imdbId, tmdbId)
                 except ValueError as e:
                     raise Exception(f"Invalid data format in line {i+2}: {str(e)}")
         except Exception as e:
             raise Exception(f"Error loading links data: {str(e)}")
     
+    def _row_count(self):
+        return len(self.links)
+    
+    def _add_link(self, movieId, imdbId, tmdbId):
+        self.links.append(Link(movieId, imdbId, tmdbId))
+        position = len(self.links) - 1
+        self.movieid_to_link.positions[movieId] = position
+        if self._title_to_link is not None:
+            movie = self.movies_obj.movieid_to_movie.get(movieId)
+            if movie:
+                self._title_to_link.positions[movie['title'].lower()] = position
+    
+    @property
+    def title_to_link(self):
+        if self._title_to_link is None:
+            positions = {}
+            get_movie = self.movies_obj.movieid_to_movie.get
+            for position, movie_id in enumerate(_record_column(self.links, 'movieId')):
+                movie = get_movie(movie_id)
+                if movie:
+                    positions[movie.title.lower()] = position
+            self._title_to_link = _RecordIndex(self.links, positions)
+        return self._title_to_link
+    
+    def _snapshot_sections(self):
+        imdb_ids, imdb_offsets = _pack_string_column(l.imdbId for l in self.links)
+        tmdb_ids, tmdb_offsets = _pack_string_column(l.tmdbId for l in self.links)
+        return {'movieId': array('i', (l.movieId for l in self.links)),
+                'imdbId': imdb_ids, 'imdbOffsets': imdb_offsets,
+                'tmdbId': tmdb_ids, 'tmdbOffsets': tmdb_offsets}
+    
+    def _restore_snapshot(self, sections):
+        ids = sections['movieId']
+        imdb_ids = _StringColumn(sections['imdbId'], sections['imdbOffsets'])
+        tmdb_ids = _StringColumn(sections['tmdbId'], sections['tmdbOffsets'])
+        build = lambda position: Link(ids[position], imdb_ids[position], tmdb_ids[position])
+        self.links = _LazyRecords(len(ids), build, {'movieId': ids})
+        self.movieid_to_link = _RecordIndex(self.links, dict(zip(ids, range(len(ids)))))
+    
     def get_links(self):
         return self.links
     
+    @_timed
     def get_movie_links(self, movie_id):
-        return self.movieid_to_link.get(str(movie_id), None)
+        try:
+            return self.movieid_to_link.get(int(movie_id), None)
+        except (TypeError, ValueError):
+            return None
     
+    @_timed
     def get_link_by_title(self, title):
         return self.title_to_link.get(title.lower(), None)
     
+    @_timed
     def get_imdb_link(self, movie_id):
         link = self.get_movie_links(movie_id)
         if link:
-            imdb_id = link['imdbId']
-            return f"https://www.imdb.com/title/tt{str(imdb_id).zfill(7)}/"
+            return IMDB_URL.format(str(link['imdbId']).zfill(7))
         return ""
+    
+    def _link_columns(self, links):
+        imdb_ids = [link.imdbId if link else None for link in links]
+        tmdb_ids = [link.tmdbId if link else None for link in links]
+        return {'imdbId': imdb_ids, 'tmdbId': tmdb_ids,
+                'imdb_url': [IMDB_URL.format(imdb_id.zfill(7)) if imdb_id else '' for imdb_id in imdb_ids],
+                'tmdb_url': [TMDB_URL.format(tmdb_id) if tmdb_id else '' for tmdb_id in tmdb_ids]}
+    
+    @_timed
+    def get_links_batch(self, movie_ids):
+        return self._link_columns(list(map(self.get_movie_links, movie_ids)))
+    
+    @_timed
+    def get_links_by_titles(self, titles):
+        get = self.title_to_link.get
+        return self._link_columns([get(title.lower()) for title in titles])
+
+DAY = 86400
+WEEK = 7 * DAY
+
+def _utc(year, month=1, day=1):
+    return int(datetime(year, month, day, tzinfo=timezone.utc).timestamp())
+
+def _period_range(period):
+    if isinstance(period, (tuple, list)):
+        start, end = period
+        return (_period_range(start)[0] if isinstance(start, str) else int(start),
+                _period_range(end)[0] if isinstance(end, str) else int(end))
+    parts = [int(part) for part in str(period).split('-')]
+    if len(parts) == 1:
+        return _utc(parts[0]), _utc(parts[0] + 1)
+    if len(parts) == 2:
+        year, month = parts
+        return _utc(year, month), _utc(year + month // 12, month % 12 + 1)
+    if len(parts) == 3:
+        start = _utc(*parts)
+        return start, start + DAY
+    raise ValueError(f"Unknown period: {period}")
+
+def _bucket_starts(first, last, unit):
+    if unit == 'day':
+        return list(range(first - first % DAY, last + 1, DAY))
+    if unit == 'week':
+        return list(range(first - (first - 4 * DAY) % WEEK, last + 1, WEEK))
+    if unit == 'month':
+        date = datetime.fromtimestamp(first, timezone.utc)
+        year, month = date.year, date.month
+        starts = []
+        while _utc(year, month) <= last:
+            starts.append(_utc(year, month))
+            year, month = year + month // 12, month % 12 + 1
+        return starts
+    raise ValueError(f"Unknown time unit: {unit}")
+
+def _slot_cumsum(values, offsets):
+    cumsum = array('d', bytes(8 * len(values)))
+    for slot in range(len(offsets) - 1):
+        start, end = offsets[slot], offsets[slot + 1]
+        cumsum[start:end] = array('d', accumulate(values[start:end]))
+    return cumsum
+
+def _range_sum(cumsum, slot_start, first, last):
+    if last <= first:
+        return 0.0
+    return cumsum[last - 1] - (cumsum[first - 1] if first > slot_start else 0.0)
+
+def _log2_cumsum(exponents, offsets):
+    cumsum = array('d', bytes(8 * len(exponents)))
+    log2 = math.log2
+    for slot in range(len(offsets) - 1):
+        start, end = offsets[slot], offsets[slot + 1]
+        if end == start:
+            continue
+        anchor = exponents[end - 1]
+        if anchor - exponents[start] < 1000:
+            partials = accumulate(2.0 ** (e - anchor) for e in exponents[start:end])
+            cumsum[start:end] = array('d', (anchor + log2(p) for p in partials))
+            continue
+        total = -math.inf
+        for i in range(start, end):
+            high = max(total, exponents[i])
+            total = high + log2(2.0 ** (total - high) + 2.0 ** (exponents[i] - high))
+            cumsum[i] = total
+    return cumsum
+
+def _merged_kth(base, extra, k):
+    lo, hi = max(0, k + 1 - len(base)), min(k + 1, len(extra))
+    while lo < hi:
+        taken = (lo + hi) // 2
+        if extra[taken] < base[k - taken]:
+            lo = taken + 1
+        else:
+            hi = taken
+    candidates = []
+    if lo:
+        candidates.append(extra[lo - 1])
+    if k >= lo:
+        candidates.append(base[k - lo])
+    return max(candidates)
 
 class Ratings:
-    def __init__(self, source, movies_obj):
-        self.ratings = []
+    def __init__(self, source, movies_obj, cache=False, workers=1):
+        self.version = 0
+        self.query_cache = QueryCache()
         self.movies_obj = movies_obj
-        self.movieid_to_ratings = {}
-        self.title_to_ratings = {}
+        self.workers = workers
+        self.user_ids = array('i')
+        self.movie_ids = array('i')
+        self.values = array('d')
+        self.timestamps = array('q')
+        self.movie_keys = array('i')
+        self.movie_offsets = array('q', [0])
+        self.movieid_to_slot = {}
+        self.rejected = Counter()
+        self.delta = (array('i'), array('i'), array('d'), array('q'))
+        self.delta_rows = {}
+        self.delta_users = {}
+        self._ratings_view = None
+        self._aggregates = None
+        self._new_slots = {}
+        self._user_index = None
+        self._user_stats = None
+        self._time_index = None
+        self._sorted_values = None
+        self._decay_weights = {}
+        self._movie_genres = None
         try:
-            if isinstance(source, str):
-                import os
-                tried_paths = [source]
-                f = None
-                try:
-                    f = open(source, 'r', encoding='utf-8')
-                except FileNotFoundError:
-                    alt_path = os.path.join(os.path.pardir, source)
-                    tried_paths.append(alt_path)
-                    try:
-                        f = open(alt_path, 'r', encoding='utf-8')
-                    except FileNotFoundError:
-                        script_dir = os.path.dirname(os.path.abspath(__file__))
-                        alt_path2 = os.path.join(script_dir, source)
-                        tried_paths.append(alt_path2)
-                        try:
-                            f = open(alt_path2, 'r', encoding='utf-8')
-                        except FileNotFoundError:
-                            raise FileNotFoundError(f"Не найден файл {source}. Пробовал пути: {tried_paths}")
-                with f:
-                    self._load_data(f)
-            else:
-                self._load_data(source)
+            _load_source(self, source, cache)
         except (IOError, OSError) as e:
             raise Exception(f"Failed to load ratings data: {str(e)}")
     
     def _load_data(self, file_obj):
+        user_ids, movie_ids = array('i'), array('i')
+        values, timestamps = array('d'), array('q')
         try:
-            next(file_obj)
-            for i, line in enumerate(file_obj):
-                try:
-                    parts = line.strip().split(',')
-                    if len(parts) < 4:
-                        continue
-                    userId, movieId, rating, timestamp = parts
-                    r = {'userId': userId, 'movieId': movieId, 'rating': float(rating), 'timestamp': int(timestamp)}
-                    self.ratings.append(r)
-                    self.movieid_to_ratings.setdefault(movieId, []).append(r)
-                    movie = self.movies_obj.get_movie(movieId)
-                    if movie:
-                        self.title_to_ratings.setdefault(movie['title'].lower(), []).append(r)
-                except ValueError as e:
-                    raise Exception(f"Invalid data format in line {i+2}: {str(e)}")
+            for chunk in iter_rating_chunks(file_obj, rejected=self.rejected):
+                user_ids.extend(chunk[0])
+                movie_ids.extend(chunk[1])
+                values.extend(chunk[2])
+                timestamps.extend(chunk[3])
         except Exception as e:
             raise Exception(f"Error loading ratings data: {str(e)}")
+        self._build_columns(user_ids, movie_ids, values, timestamps)
+    
+    def _load_parallel(self, path):
+        user_ids, movie_ids = array('i'), array('i')
+        values, timestamps = array('d'), array('q')
+        try:
+            for chunk, rejected in _parse_parallel(path, _parse_rating_range, self.workers):
+                user_ids.extend(chunk[0])
+                movie_ids.extend(chunk[1])
+                values.extend(chunk[2])
+                timestamps.extend(chunk[3])
+                self.rejected.update(rejected)
+        except Exception as e:
+            raise Exception(f"Error loading ratings data: {str(e)}")
+        self._build_columns(user_ids, movie_ids, values, timestamps)
+    
+    def _row_count(self):
+        return len(self)
+    
+    def _build_columns(self, user_ids, movie_ids, values, timestamps):
+        self.version += 1
+        with _phase('Ratings.index'):
+            self.movie_keys, self.movie_offsets, perm = _counting_sort(movie_ids)
+            self.user_ids = _take(user_ids, perm)
+            self.movie_ids = _take(movie_ids, perm)
+            self.values = _take(values, perm)
+            self.timestamps = _take(timestamps, perm)
+        self.movieid_to_slot = {movie_id: slot for slot, movie_id in enumerate(self.movie_keys)}
+        self._ratings_view = None
+        self._aggregates = None
+        self._new_slots = {}
+        self._user_index = None
+        self._user_stats = None
+        self._time_index = None
+        self._sorted_values = None
+        self._decay_weights = {}
+    
+    def append(self, rows):
+        user_ids, movie_ids, values, timestamps = self.delta
+        start = len(values)
+        for row in rows:
+            if isinstance(row, (dict, _Record)):
+                row = row['userId'], row['movieId'], row['rating'], row['timestamp']
+            user_ids.append(int(row[0]))
+            movie_ids.append(int(row[1]))
+            values.append(float(row[2]))
+            timestamps.append(int(row[3]))
+        return self._index_delta(start)
+    
+    def _append_columns(self, chunk):
+        start = len(self.delta[2])
+        for column, part in zip(self.delta, chunk):
+            column.extend(part)
+        return self._index_delta(start)
+    
+    def _index_delta(self, start):
+        user_ids, movie_ids, values, _ = self.delta
+        added = len(values) - start
+        if not added:
+            return 0
+        delta_rows, delta_users = self.delta_rows, self.delta_users
+        for position in range(start, len(values)):
+            delta_rows.setdefault(movie_ids[position], []).append(position)
+            delta_users.setdefault(user_ids[position], []).append(position)
+        self.version += 1
+        self._ratings_view = None
+        if len(values) > max(COMPACT_MIN_ROWS, len(self.values) * COMPACT_RATIO):
+            self.compact()
+        elif self._aggregates is not None:
+            self._overlay_delta(self._aggregates, start)
+        return added
+    
+    def ingest_delta(self, source, chunk_size=None):
+        added = 0
+        try:
+            for chunk in iter_rating_chunks(source, chunk_size, rejected=self.rejected):
+                added += self._append_columns(chunk)
+        except (IOError, OSError) as e:
+            raise Exception(f"Failed to load ratings delta: {str(e)}")
+        return added
+    
+    def tail(self, source, offset=None, poll_interval=1.0, polls=None):
+        for lines, offset in tail_csv(source, offset, poll_interval, polls):
+            added = 0
+            for chunk in _rating_line_chunks(lines, DEFAULT_CHUNK_ROWS, 1, f" after byte {offset}", self.rejected):
+                added += self._append_columns(chunk)
+            yield added, offset
+    
+    def compact(self):
+        if not self.delta[2]:
+            return
+        columns = []
+        for column, part in zip((self.user_ids, self.movie_ids, self.values, self.timestamps), self.delta):
+            merged = _copy_column(column)
+            merged.extend(part)
+            columns.append(merged)
+        self.delta = (array('i'), array('i'), array('d'), array('q'))
+        self.delta_rows = {}
+        self.delta_users = {}
+        self._build_columns(*columns)
+    
+    def _snapshot_sections(self):
+        user_keys, user_offsets, user_perm, _ = self.get_user_index()
+        user_sums, user_histograms = self._get_user_stats()
+        time_perm, time_stamps, time_sums, global_times, global_sums = self.get_time_index()
+        return {'userId': self.user_ids, 'movieId': self.movie_ids, 'rating': self.values,
+                'sortedRating': self.get_sorted_values(),
+                'timestamp': self.timestamps, 'movieKeys': self.movie_keys,
+                'movieOffsets': self.movie_offsets, 'userKeys': user_keys,
+                'userOffsets': user_offsets, 'userPerm': user_perm,
+                'userSums': user_sums, 'userHistograms': user_histograms,
+                'timePerm': time_perm, 'timeStamps': time_stamps, 'timeSums': time_sums,
+                'globalTimes': global_times, 'globalSums': global_sums,
+                'rejected': _pack_counter(self.rejected)}
+    
+    def _restore_snapshot(self, sections):
+        self.version += 1
+        self.rejected = _unpack_counter(sections['rejected'])
+        self.user_ids = sections['userId']
+        self.movie_ids = sections['movieId']
+        self.values = sections['rating']
+        self._sorted_values = sections['sortedRating']
+        self.timestamps = sections['timestamp']
+        self.movie_keys = sections['movieKeys']
+        self.movie_offsets = sections['movieOffsets']
+        self.movieid_to_slot = {movie_id: slot for slot, movie_id in enumerate(self.movie_keys)}
+        self._ratings_view = None
+        self._aggregates = None
+        self._new_slots = {}
+        user_keys = sections['userKeys']
+        self._user_index = (user_keys, sections['userOffsets'], sections['userPerm'],
+                            {user_id: slot for slot, user_id in enumerate(user_keys)})
+        self._user_stats = (sections['userSums'], sections['userHistograms'])
+        self._time_index = (sections['timePerm'], sections['timeStamps'], sections['timeSums'],
+                            sections['globalTimes'], sections['globalSums'])
+        self._decay_weights = {}
+    
+    def __len__(self):
+        return len(self.values) + len(self.delta[2])
+    
+    def _movie_range(self, movie_id):
+        try:
+            slot = self.movieid_to_slot.get(int(movie_id))
+        except (TypeError, ValueError):
+            return 0, 0
+        if slot is None:
+            return 0, 0
+        return self.movie_offsets[slot], self.movie_offsets[slot + 1]
+    
+    def _delta_positions(self, movie_id):
+        try:
+            return self.delta_rows.get(int(movie_id), ())
+        except (TypeError, ValueError):
+            return ()
+    
+    def _delta_user_positions(self, user_id):
+        try:
+            return self.delta_users.get(int(user_id), ())
+        except (TypeError, ValueError):
+            return ()
+    
+    def _delta_window(self, movie_id=None, start=None, end=None):
+        _, _, values, timestamps = self.delta
+        positions = range(len(values)) if movie_id is None else self._delta_positions(movie_id)
+        return [(timestamps[i], values[i]) for i in positions
+                if (start is None or timestamps[i] >= start) and (end is None or timestamps[i] < end)]
+    
+    def _rows(self, positions, columns=None):
+        user_ids, movie_ids, values, timestamps = columns or (self.user_ids, self.movie_ids,
+                                                              self.values, self.timestamps)
+        return [{'userId': user_ids[i], 'movieId': movie_ids[i],
+                 'rating': values[i], 'timestamp': timestamps[i]}
+                for i in positions]
     
     def get_ratings(self):
-        return self.ratings
+        if self._ratings_view is None:
+            self._ratings_view = self._rows(range(len(self.values)))
+            self._ratings_view.extend(self._rows(range(len(self.delta[2])), self.delta))
+        return self._ratings_view
     
+    @_timed
     def get_movie_ratings(self, movie_id):
-        return self.movieid_to_ratings.get(str(movie_id), [])
+        rows = self._rows(range(*self._movie_range(movie_id)))
+        rows.extend(self._rows(self._delta_positions(movie_id), self.delta))
+        return rows
     
+    @_timed
     def get_ratings_by_title(self, title):
-        return self.title_to_ratings.get(title.lower(), [])
+        movie = self.movies_obj.get_movie_by_title(title)
+        if not movie:
+            return []
+        return self.get_movie_ratings(movie['movieId'])
+    
+    @_timed
+    def get_movie_rating_values(self, movie_id):
+        start, end = self._movie_range(movie_id)
+        positions = self._delta_positions(movie_id)
+        if positions:
+            return array('d', chain(self.values[start:end], map(self.delta[2].__getitem__, positions)))
+        return memoryview(self.values)[start:end]
     
+    def get_title_rating_values(self, title):
+        movie = self.movies_obj.get_movie_by_title(title)
+        if not movie:
+            return memoryview(self.values)[0:0]
+        return self.get_movie_rating_values(movie['movieId'])
+    
+    def _cache_version(self):
+        return self.version, self.movies_obj.version
+    
+    @cached_query
     def get_average_rating(self, movie_id):
-        ratings = self.get_movie_ratings(movie_id)
-        if not ratings:
+        values = self.get_movie_rating_values(movie_id)
+        if not values:
             return 0.0
-        return sum(r['rating'] for r in ratings) / len(ratings)
+        return sum(values) / len(values)
     
+    @cached_query
     def get_median_rating(self, movie_id):
-        ratings = [r['rating'] for r in self.get_movie_ratings(movie_id)]
-        if not ratings:
+        start, end = self._movie_range(movie_id)
+        count = end - start + len(self._delta_positions(movie_id))
+        if not count:
+            return 0.0
+        return self._merged_median(movie_id, count)
+    
+    def get_sorted_values(self):
+        if self._sorted_values is None:
+            with _phase('Ratings.sorted_values'):
+                values = _copy_column(self.values)
+                offsets = self.movie_offsets
+                for slot in range(len(self.movie_keys)):
+                    start, end = offsets[slot], offsets[slot + 1]
+                    if end - start > 1:
+                        values[start:end] = array('d', sorted(values[start:end]))
+                self._sorted_values = values
+        return self._sorted_values
+    
+    def get_user_index(self):
+        if self._user_index is None:
+            with _phase('Ratings.user_index'):
+                user_keys, user_offsets, user_perm = _counting_sort(self.user_ids)
+                timestamps = self.timestamps
+                for slot in range(len(user_keys)):
+                    start, end = user_offsets[slot], user_offsets[slot + 1]
+                    if end - start > 1:
+                        user_perm[start:end] = array('q', sorted(user_perm[start:end], key=timestamps.__getitem__))
+            self._user_index = (user_keys, user_offsets, user_perm,
+                                {user_id: slot for slot, user_id in enumerate(user_keys)})
+        return self._user_index
+    
+    def _user_slot(self, user_id):
+        try:
+            return self.get_user_index()[3].get(int(user_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def get_user_positions(self, user_id):
+        user_keys, user_offsets, user_perm, _ = self.get_user_index()
+        slot = self._user_slot(user_id)
+        if slot is None:
+            return memoryview(user_perm)[0:0]
+        return memoryview(user_perm)[user_offsets[slot]:user_offsets[slot + 1]]
+    
+    @_timed
+    def get_user_ratings(self, user_id):
+        rows = self._rows(self.get_user_positions(user_id))
+        positions = self._delta_user_positions(user_id)
+        if positions:
+            rows.extend(self._rows(positions, self.delta))
+            rows.sort(key=lambda row: row['timestamp'])
+        return rows
+    
+    def _get_user_stats(self):
+        if self._user_stats is None:
+            with _phase('Ratings.user_stats'):
+                self._user_stats = self._compute_user_stats()
+        return self._user_stats
+    
+    def _compute_user_stats(self):
+        user_keys, user_offsets, user_perm, _ = self.get_user_index()
+        n_users = len(user_keys)
+        sums = array('d', bytes(8 * n_users))
+        histograms = array('q', bytes(8 * n_users * RATING_BINS))
+        values, timestamps = self.values, self.timestamps
+        for slot in range(n_users):
+            start, end = user_offsets[slot], user_offsets[slot + 1]
+            segment = list(map(values.__getitem__, user_perm[start:end]))
+            sums[slot] = sum(segment)
+            base = slot * RATING_BINS
+            for rating_bin, count in Counter(map(_rating_bin, segment)).items():
+                histograms[base + rating_bin] = count
+        return sums, histograms
+    
+    def _get_movie_genres(self):
+        if self._movie_genres is None:
+            self._movie_genres = {movie['movieId']: movie['genres'] for movie in self.movies_obj.get_movies()}
+        return self._movie_genres
+    
+    @cached_query
+    def get_user_profile(self, user_id, n_genres=3):
+        slot = self._user_slot(user_id)
+        positions = self._delta_user_positions(user_id)
+        if slot is None and not positions:
+            return None
+        count, total, histogram, rated, times = 0, 0.0, [0] * RATING_BINS, [], []
+        if slot is not None:
+            sums, histograms = self._get_user_stats()
+            user_keys, user_offsets, user_perm, _ = self.get_user_index()
+            start, end = user_offsets[slot], user_offsets[slot + 1]
+            count, total = end - start, sums[slot]
+            histogram = histograms[slot * RATING_BINS:(slot + 1) * RATING_BINS].tolist()
+            rated = map(self.movie_ids.__getitem__, user_perm[start:end])
+            times = [self.timestamps[user_perm[start]], self.timestamps[user_perm[end - 1]]]
+        _, delta_movies, delta_values, delta_times = self.delta
+        for position in positions:
+            count += 1
+            total += delta_values[position]
+            histogram[_rating_bin(delta_values[position])] += 1
+        if positions:
+            rated = chain(rated, map(delta_movies.__getitem__, positions))
+            times.extend(map(delta_times.__getitem__, positions))
+        genres = Counter()
+        if n_genres:
+            movie_genres = self._get_movie_genres()
+            genres.update(chain.from_iterable(map(movie_genres.get, rated, repeat(()))))
+        return {'userId': int(user_id),
+                'count': count,
+                'mean': total / count,
+                'histogram': histogram,
+                'favourite_genres': genres.most_common(n_genres),
+                'first_timestamp': min(times),
+                'last_timestamp': max(times)}
+    
+    def get_user_profiles(self, user_ids, n_genres=3):
+        return {user_id: self.get_user_profile(user_id, n_genres) for user_id in user_ids}
+    
+    def get_time_index(self):
+        if self._time_index is None:
+            with _phase('Ratings.time_index'):
+                self._time_index = self._compute_time_index()
+        return self._time_index
+    
+    def _compute_time_index(self):
+        timestamps, values, offsets = self.timestamps, self.values, self.movie_offsets
+        perm = array('q', range(len(values)))
+        for slot in range(len(self.movie_keys)):
+            start, end = offsets[slot], offsets[slot + 1]
+            if end - start > 1:
+                perm[start:end] = array('q', sorted(perm[start:end], key=timestamps.__getitem__))
+        times = array('q', map(timestamps.__getitem__, perm))
+        sums = _slot_cumsum(array('d', map(values.__getitem__, perm)), offsets)
+        order = sorted(range(len(times)), key=times.__getitem__)
+        global_times = array('q', map(times.__getitem__, order))
+        global_values = array('d', map(values.__getitem__, map(perm.__getitem__, order)))
+        return perm, times, sums, global_times, _slot_cumsum(global_values, (0, len(order)))
+    
+    def _time_window(self, movie_id, period=None):
+        _, times, sums, global_times, global_sums = self.get_time_index()
+        if movie_id is None:
+            times, sums, slot_start, slot_end = global_times, global_sums, 0, len(global_times)
+        else:
+            slot_start, slot_end = self._movie_range(movie_id)
+        lo, hi = slot_start, slot_end
+        if period is not None:
+            start, end = _period_range(period)
+            lo, hi = bisect_left(times, start, lo, hi), bisect_left(times, end, lo, hi)
+        return times, sums, slot_start, lo, hi
+    
+    @_timed
+    def get_window_stats(self, period, movie_id=None):
+        start, end = _period_range(period)
+        _, sums, slot_start, lo, hi = self._time_window(movie_id, (start, end))
+        extra = [value for _, value in self._delta_window(movie_id, start, end)]
+        count = hi - lo + len(extra)
+        total = _range_sum(sums, slot_start, lo, hi) + sum(extra)
+        stats = {'start': start, 'end': end, 'count': count, 'mean': total / count if count else 0.0}
+        if movie_id is not None:
+            window = sorted(chain(map(self.values.__getitem__, self.get_time_index()[0][lo:hi]), extra))
+            mid = count // 2
+            stats['median'] = 0.0 if not count else window[mid] if count % 2 else (window[mid-1] + window[mid]) / 2
+        return stats
+    
+    @_timed
+    def get_rating_buckets(self, unit='month', movie_id=None, period=None):
+        times, sums, slot_start, lo, hi = self._time_window(movie_id, period)
+        buckets = {}
+        if lo < hi:
+            starts = _bucket_starts(times[lo], times[hi - 1], unit)
+            ends = [bisect_left(times, t, lo, hi) for t in starts[1:]] + [hi]
+            first = lo
+            for bucket_start, last in zip(starts, ends):
+                if last > first:
+                    buckets[bucket_start] = [last - first, _range_sum(sums, slot_start, first, last)]
+                first = last
+        bounds = _period_range(period) if period is not None else (None, None)
+        for timestamp, value in self._delta_window(movie_id, *bounds):
+            bucket = buckets.setdefault(_bucket_starts(timestamp, timestamp, unit)[0], [0, 0.0])
+            bucket[0] += 1
+            bucket[1] += value
+        return [(bucket_start, count, total / count) for bucket_start, (count, total) in sorted(buckets.items())]
+    
+    def _get_decay_weights(self, half_life):
+        if half_life not in self._decay_weights:
+            times = self.get_time_index()[1]
+            exponents = array('d', (t / half_life for t in times))
+            self._decay_weights[half_life] = _log2_cumsum(exponents, self.movie_offsets)
+        return self._decay_weights[half_life]
+    
+    @cached_query
+    def trending(self, n=10, method='decay', now=None, half_life=30 * DAY, window=30 * DAY, min_count=1):
+        _, times, _, global_times, _ = self.get_time_index()
+        delta_times = self.delta[3]
+        if method not in ('decay', 'delta') or not len(self):
+            return []
+        if now is None:
+            now = max(chain(global_times[-1:], delta_times)) + 1
+        offsets, keys = self.movie_offsets, self.movie_keys
+        scores, counts = {}, {}
+        if method == 'decay':
+            log_weights = self._get_decay_weights(half_life)
+            now_exponent = now / half_life
+            for slot in range(len(keys)):
+                start = offsets[slot]
+                last = bisect_left(times, now, start, offsets[slot + 1])
+                counts[keys[slot]] = last - start
+                scores[keys[slot]] = 2.0 ** (log_weights[last - 1] - now_exponent) if last > start else 0.0
+            for movie_id, positions in self.delta_rows.items():
+                recent = [delta_times[i] for i in positions if delta_times[i] < now]
+                counts[movie_id] = counts.get(movie_id, 0) + len(recent)
+                scores[movie_id] = scores.get(movie_id, 0.0) + sum(2.0 ** ((t - now) / half_life) for t in recent)
+        else:
+            for slot in range(len(keys)):
+                start, end = offsets[slot], offsets[slot + 1]
+                previous = bisect_left(times, now - 2 * window, start, end)
+                current = bisect_left(times, now - window, previous, end)
+                last = bisect_left(times, now, current, end)
+                counts[keys[slot]] = last - current
+                scores[keys[slot]] = (last - current) - (current - previous)
+            for movie_id, positions in self.delta_rows.items():
+                recent = sum(1 for i in positions if now - window <= delta_times[i] < now)
+                older = sum(1 for i in positions if now - 2 * window <= delta_times[i] < now - window)
+                counts[movie_id] = counts.get(movie_id, 0) + recent
+                scores[movie_id] = scores.get(movie_id, 0) + recent - older
+        get_movie = self.movies_obj.movieid_to_movie.get
+        candidates = [movie_id for movie_id, count in counts.items() if count >= min_count and get_movie(movie_id)]
+        return [(get_movie(movie_id), scores[movie_id])
+                for movie_id in heapq.nlargest(n, candidates, key=scores.__getitem__)]
+    
+    def get_aggregates(self):
+        if self._aggregates is None:
+            with _phase('Ratings.aggregates'):
+                aggregates = self._compute_aggregates()
+            self._new_slots = {}
+            self._overlay_delta(aggregates, 0)
+            self._aggregates = aggregates
+        return self._aggregates
+    
+    def _compute_aggregates(self):
+        n_movies = len(self.movie_keys)
+        counts = array('q', bytes(8 * n_movies))
+        sums = array('d', bytes(8 * n_movies))
+        means = array('d', bytes(8 * n_movies))
+        medians = array('d', bytes(8 * n_movies))
+        variances = array('d', bytes(8 * n_movies))
+        values = memoryview(self.get_sorted_values())
+        offsets = self.movie_offsets
+        for slot in range(n_movies):
+            start, end = offsets[slot], offsets[slot + 1]
+            count = end - start
+            if not count:
+                continue
+            segment = values[start:end]
+            total = sum(segment)
+            mean = total / count
+            mid = start + count // 2
+            counts[slot] = count
+            sums[slot] = total
+            means[slot] = mean
+            medians[slot] = values[mid] if count % 2 else (values[mid-1] + values[mid]) / 2
+            variances[slot] = max(sum(map(mul, segment, segment)) / count - mean * mean, 0.0)
+        return {'movieId': _copy_column(self.movie_keys), 'count': counts, 'sum': sums,
+                'mean': means, 'median': medians, 'variance': variances}
+    
+    def _overlay_delta(self, aggregates, start):
+        _, movie_ids, values, _ = self.delta
+        batch = {}
+        for position in range(start, len(values)):
+            value = values[position]
+            stats = batch.get(movie_ids[position])
+            if stats is None:
+                batch[movie_ids[position]] = [1, value, value * value]
+            else:
+                stats[0] += 1
+                stats[1] += value
+                stats[2] += value * value
+        keys, counts, sums = aggregates['movieId'], aggregates['count'], aggregates['sum']
+        means, medians, variances = aggregates['mean'], aggregates['median'], aggregates['variance']
+        for movie_id, (added, total, squares) in batch.items():
+            slot = self._aggregate_slot(movie_id)
+            if slot is None:
+                slot = self._new_slots[movie_id] = len(keys)
+                for column in aggregates.values():
+                    column.append(0)
+                keys[slot] = movie_id
+            squares += (variances[slot] + means[slot] * means[slot]) * counts[slot]
+            count = counts[slot] = counts[slot] + added
+            total = sums[slot] = sums[slot] + total
+            mean = means[slot] = total / count
+            variances[slot] = max(squares / count - mean * mean, 0.0)
+            medians[slot] = self._merged_median(movie_id, count)
+    
+    def _merged_median(self, movie_id, count):
+        start, end = self._movie_range(movie_id)
+        base = memoryview(self.get_sorted_values())[start:end]
+        extra = sorted(map(self.delta[2].__getitem__, self._delta_positions(movie_id)))
+        mid = count // 2
+        if count % 2:
+            return _merged_kth(base, extra, mid)
+        return (_merged_kth(base, extra, mid - 1) + _merged_kth(base, extra, mid)) / 2
+    
+    def _aggregate_slot(self, movie_id):
+        slot = self.movieid_to_slot.get(movie_id)
+        return self._new_slots.get(movie_id) if slot is None else slot
+    
+    def _bayesian_scores(self, aggregates, prior):
+        counts, means = aggregates['count'], aggregates['mean']
+        n_movies = len(counts)
+        global_mean = sum(aggregates['sum']) / len(self) if len(self) else 0.0
+        if prior is None:
+            prior = len(self) / n_movies if n_movies else 0.0
+        return array('d', [(c * m + prior * global_mean) / (c + prior) if c + prior else 0.0
+                            for c, m in zip(counts, means)])
+    
+    def _candidate_slots(self, aggregates, genres, years):
+        if genres is None and years is None:
+            return range(len(aggregates['movieId']))
+        movies = self.movies_obj.filter_movies(genres, years)
+        slots = map(self._aggregate_slot, {movie.movieId for movie in movies})
+        return sorted(slot for slot in slots if slot is not None)
+    
+    @_timed
+    def get_aggregates_batch(self, movie_ids):
+        aggregates = self.get_aggregates()
+        counts, means, medians = aggregates['count'], aggregates['mean'], aggregates['median']
+        slots = []
+        for movie_id in movie_ids:
+            try:
+                slots.append(self._aggregate_slot(int(movie_id)))
+            except (TypeError, ValueError):
+                slots.append(None)
+        return {'rating_count': [0 if slot is None else counts[slot] for slot in slots],
+                'rating_mean': [None if slot is None else means[slot] for slot in slots],
+                'rating_median': [None if slot is None else medians[slot] for slot in slots]}
+    
+    @cached_query
+    def get_rating_bitmap(self, min_rating=None, min_count=None):
+        aggregates = self.get_aggregates()
+        keys, counts, means = aggregates['movieId'], aggregates['count'], aggregates['mean']
+        min_count = max(min_count or 0, 1)
+        positions = self.movies_obj.get_facets()['position']
+        selected = (positions.get(keys[slot]) for slot in range(len(keys))
+                    if counts[slot] >= min_count and (min_rating is None or means[slot] >= min_rating))
+        return _bitmap(position for position in selected if position is not None)
+    
+    @_timed
+    def filter_movies(self, genres=None, years=None, decades=None, min_rating=None, min_count=None,
+                      sort='mean', n=None):
+        bitmap = self.movies_obj.facet_bitmap(genres, years, decades)
+        if min_rating is not None or min_count is not None:
+            bitmap &= self.get_rating_bitmap(min_rating, min_count)
+        movies = self.movies_obj.movies_from_bitmap(bitmap)
+        if sort not in ('mean', 'median', 'count'):
+            return [(movie, None) for movie in movies[:n]]
+        scores = self.get_aggregates()[sort]
+        scored = []
+        for movie in movies:
+            slot = self._aggregate_slot(movie.movieId)
+            scored.append((movie, scores[slot] if slot is not None else 0.0))
+        if n is None:
+            return sorted(scored, key=lambda item: -item[1])
+        return heapq.nlargest(n, scored, key=lambda item: item[1])
+    
+    @cached_query
+    def top_by_ratings(self, n=10, method='mean', min_count=1, genres=None, years=None, prior=None):
+        aggregates = self.get_aggregates()
+        if method == 'bayesian':
+            scores = self._bayesian_scores(aggregates, prior)
+        elif method in ('mean', 'median', 'count'):
+            scores = aggregates[method]
+        else:
+            return []
+        keys, counts = aggregates['movieId'], aggregates['count']
+        min_count = max(min_count, 1)
+        get_movie = self.movies_obj.movieid_to_movie.get
+        slots = [slot for slot in self._candidate_slots(aggregates, genres, years)
+                 if counts[slot] >= min_count and get_movie(keys[slot])]
+        return [(get_movie(keys[slot]), scores[slot])
+                for slot in heapq.nlargest(n, slots, key=scores.__getitem__)]
+
+RATING_BINS = 11
+
+def _rating_bin(value):
+    return min(max(int(value * 2 + 0.5), 0), RATING_BINS - 1)
+
+class RatingAggregator:
+    def __init__(self, movies_obj=None):
+        self.movies_obj = movies_obj
+        self.movie_keys = array('i')
+        self.counts = array('q')
+        self.sums = array('d')
+        self.histograms = array('q')
+        self.movieid_to_slot = {}
+    
+    def __len__(self):
+        return sum(self.counts)
+    
+    def _slot(self, movie_id):
+        slot = self.movieid_to_slot.get(movie_id)
+        if slot is None:
+            slot = self.movieid_to_slot[movie_id] = len(self.movie_keys)
+            self.movie_keys.append(movie_id)
+            self.counts.append(0)
+            self.sums.append(0.0)
+            self.histograms.extend(bytes(8 * RATING_BINS))
+        return slot
+    
+    def add(self, movie_id, value):
+        slot = self._slot(movie_id)
+        self.counts[slot] += 1
+        self.sums[slot] += value
+        self.histograms[slot * RATING_BINS + _rating_bin(value)] += 1
+    
+    def update(self, chunk):
+        movie_ids, values = chunk[1], chunk[2]
+        counts, sums, histograms = self.counts, self.sums, self.histograms
+        get_slot = self.movieid_to_slot.get
+        for movie_id, value in zip(movie_ids, values):
+            slot = get_slot(movie_id)
+            if slot is None:
+                slot = self._slot(movie_id)
+            counts[slot] += 1
+            sums[slot] += value
+            histograms[slot * RATING_BINS + _rating_bin(value)] += 1
+        return self
+    
+    def merge(self, other):
+        for other_slot, movie_id in enumerate(other.movie_keys):
+            slot = self._slot(movie_id)
+            self.counts[slot] += other.counts[other_slot]
+            self.sums[slot] += other.sums[other_slot]
+            base, other_base = slot * RATING_BINS, other_slot * RATING_BINS
+            for b in range(RATING_BINS):
+                self.histograms[base + b] += other.histograms[other_base + b]
+        return self
+    
+    def _lookup(self, movie_id):
+        try:
+            return self.movieid_to_slot.get(int(movie_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def _median(self, slot):
+        count = self.counts[slot]
+        if not count:
+            return 0.0
+        histogram = self.histograms[slot * RATING_BINS:(slot + 1) * RATING_BINS]
+        cumulative = array('q')
+        total = 0
+        for c in histogram:
+            total += c
+            cumulative.append(total)
+        low = bisect_left(cumulative, (count - 1) // 2 + 1) / 2
+        high = bisect_left(cumulative, count // 2 + 1) / 2
+        return (low + high) / 2
+    
+    def get_count(self, movie_id):
+        slot = self._lookup(movie_id)
+        return 0 if slot is None else self.counts[slot]
+    
+    def get_average_rating(self, movie_id):
+        slot = self._lookup(movie_id)
+        if slot is None or not self.counts[slot]:
             return 0.0
-        ratings.sort()
-        n = len(ratings)
-        mid = n // 2
-        if n % 2:
-            return ratings[mid]
-        return (ratings[mid-1] + ratings[mid]) / 2
-    
-    def top_by_ratings(self, n=10, method='mean'):
-        movie_scores = []
-        for movie in self.movies_obj.get_movies():
-            ratings = self.get_movie_ratings(movie['movieId'])
-            if ratings:
-                values = [r['rating'] for r in ratings]
-                if method == 'mean':
-                    score = sum(values) / len(values)
-                elif method == 'median':
-                    values.sort()
-                    mid = len(values) // 2
-                    score = values[mid] if len(values) % 2 else (values[mid-1] + values[mid]) / 2
+        return self.sums[slot] / self.counts[slot]
+    
+    def get_median_rating(self, movie_id):
+        slot = self._lookup(movie_id)
+        return 0.0 if slot is None else self._median(slot)
+    
+    def get_histogram(self, movie_id):
+        slot = self._lookup(movie_id)
+        if slot is None:
+            return [0] * RATING_BINS
+        return self.histograms[slot * RATING_BINS:(slot + 1) * RATING_BINS].tolist()
+    
+    def top_by_ratings(self, n=10, method='mean', min_count=1):
+        if method == 'mean':
+            score = lambda slot: self.sums[slot] / self.counts[slot]
+        elif method == 'median':
+            score = self._median
+        elif method == 'count':
+            score = self.counts.__getitem__
+        else:
+            return []
+        min_count = max(min_count, 1)
+        slots = [slot for slot in range(len(self.movie_keys)) if self.counts[slot] >= min_count]
+        if self.movies_obj is not None:
+            slots = [slot for slot in slots if self.movies_obj.movieid_to_movie.get(self.movie_keys[slot])]
+        result = []
+        for slot in heapq.nlargest(n, slots, key=score):
+            movie_id = self.movie_keys[slot]
+            movie = self.movies_obj.movieid_to_movie.get(movie_id) if self.movies_obj is not None else movie_id
+            result.append((movie, score(slot)))
+        return result
+
+def aggregate_ratings(source, movies_obj=None, chunk_size=None, max_memory=None):
+    aggregator = RatingAggregator(movies_obj)
+    for chunk in iter_rating_chunks(source, chunk_size, max_memory):
+        aggregator.update(chunk)
+    return aggregator
+
+HLL_PRECISION = 14
+GENRE_HLL_PRECISION = 14
+MOVIE_HLL_PRECISION = 10
+QUANTILE_ACCURACY = 0.01
+QUANTILE_MAX_BINS = 2048
+CMS_WIDTH = 4096
+CMS_DEPTH = 4
+SKETCH_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+HASH_MASK = (1 << 64) - 1
+
+def _hash64(value):
+    if isinstance(value, str):
+        return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+    x = (int(value) + 0x9E3779B97F4A7C15) & HASH_MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+    return x ^ (x >> 31)
+
+def _hll_register(h, precision):
+    rest_bits = 64 - precision
+    return h >> rest_bits, rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.sparse = {}
+        self.registers = None
+    
+    def __len__(self):
+        return self.count()
+    
+    def add(self, value):
+        self.add_hash(_hash64(value))
+    
+    def add_hash(self, h):
+        self.add_register(*_hll_register(h, self.precision))
+    
+    def add_register(self, index, rank):
+        if self.registers is not None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+        elif rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > self.m >> 5:
+                self._densify()
+    
+    def _densify(self):
+        self.registers = bytearray(self.m)
+        for index, rank in self.sparse.items():
+            self.registers[index] = rank
+        self.sparse = None
+    
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches with precision {self.precision} and {other.precision}")
+        if other.registers is None:
+            for index, rank in other.sparse.items():
+                self.add_register(index, rank)
+            return self
+        if self.registers is None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+    
+    def count(self):
+        m = self.m
+        if self.registers is None:
+            zeros = m - len(self.sparse)
+            total = zeros + sum(2.0 ** -rank for rank in self.sparse.values())
+        else:
+            zeros = self.registers.count(0)
+            total = sum(2.0 ** -rank for rank in self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / total
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+def _pack_hlls(sketches):
+    lengths, indexes, ranks = array('i'), array('i'), array('B')
+    for sketch in sketches:
+        if sketch.registers is None:
+            lengths.append(len(sketch.sparse))
+            indexes.extend(sketch.sparse)
+            ranks.extend(sketch.sparse.values())
+        else:
+            lengths.append(-1)
+            ranks.frombytes(sketch.registers)
+    return lengths, indexes, ranks
+
+def _unpack_hlls(lengths, indexes, ranks, precision):
+    sketches = []
+    index_pos = rank_pos = 0
+    for length in lengths:
+        sketch = HyperLogLog(precision)
+        if length < 0:
+            sketch.sparse = None
+            sketch.registers = bytearray(ranks[rank_pos:rank_pos + sketch.m])
+            rank_pos += sketch.m
+        else:
+            sketch.sparse = dict(zip(indexes[index_pos:index_pos + length].tolist(),
+                                     ranks[rank_pos:rank_pos + length].tolist()))
+            index_pos += length
+            rank_pos += length
+        sketches.append(sketch)
+    return sketches
+
+class QuantileSketch:
+    def __init__(self, accuracy=QUANTILE_ACCURACY, max_bins=QUANTILE_MAX_BINS):
+        self.accuracy = accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def __len__(self):
+        return self.count
+    
+    def add(self, value, count=1):
+        if value > 0:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            if key not in self.bins and len(self.bins) >= self.max_bins:
+                self._collapse()
+            self.bins[key] += count
+        else:
+            self.zeros += count
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+    
+    def _collapse(self):
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins + 1
+        self.bins[keys[excess]] += sum(self.bins.pop(key) for key in keys[:excess])
+    
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"Cannot merge quantile sketches with accuracy {self.accuracy} and {other.accuracy}")
+        self.bins.update(other.bins)
+        while len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+    
+    def to_dict(self):
+        return {'accuracy': self.accuracy, 'max_bins': self.max_bins, 'bins': sorted(self.bins.items()),
+                'zeros': self.zeros, 'count': self.count, 'min': self.min, 'max': self.max}
+    
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['accuracy'], state['max_bins'])
+        sketch.bins = Counter(dict(state['bins']))
+        sketch.zeros, sketch.count = state['zeros'], state['count']
+        sketch.min, sketch.max = state['min'], state['max']
+        return sketch
+    
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return max(self.min, 0.0)
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+class CountMinSketch:
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, top=20):
+        self.width = width
+        self.depth = depth
+        self.top = top
+        self.table = array('q', bytes(8 * width * depth))
+        self.total = 0
+        self.candidates = {}
+    
+    def _cells(self, key):
+        h = _hash64(key)
+        low, high = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [row * self.width + (low + row * high) % self.width for row in range(self.depth)]
+    
+    def add(self, key, count=1):
+        table = self.table
+        cells = self._cells(key)
+        for cell in cells:
+            table[cell] += count
+        self.total += count
+        self._track(key, min(table[cell] for cell in cells))
+    
+    def _track(self, key, estimate):
+        candidates = self.candidates
+        if key in candidates or len(candidates) < self.top:
+            candidates[key] = estimate
+            return
+        lowest = min(candidates, key=candidates.__getitem__)
+        if estimate > candidates[lowest]:
+            del candidates[lowest]
+            candidates[key] = estimate
+    
+    def estimate(self, key):
+        return min(self.table[cell] for cell in self._cells(key))
+    
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError(f"Cannot merge count-min sketches of shape {self.depth}x{self.width} and {other.depth}x{other.width}")
+        self.table = array('q', map(sum, zip(self.table, other.table)))
+        self.total += other.total
+        keys = set(self.candidates) | set(other.candidates)
+        estimates = {key: self.estimate(key) for key in keys}
+        self.candidates = dict(heapq.nlargest(self.top, estimates.items(), key=lambda item: item[1]))
+        return self
+    
+    def heavy_hitters(self, n=None):
+        estimates = sorted(((key, self.estimate(key)) for key in self.candidates),
+                           key=lambda item: (-item[1], item[0]))
+        return estimates[:n]
+
+class DatasetSketches:
+    def __init__(self, movies_obj=None):
+        self.movie_genres = {} if movies_obj is None else {
+            movie['movieId']: movie['genres'] for movie in movies_obj.get_movies()}
+        self.n_ratings = 0
+        self.n_tags = 0
+        self.users = HyperLogLog()
+        self.tag_names = HyperLogLog()
+        self.rating_quantiles = QuantileSketch()
+        self.tag_counts = CountMinSketch()
+        self.movie_users = {}
+        self.movie_tags = {}
+        self.genre_users = {}
+        self.genre_tags = {}
+        self.genre_quantiles = {}
+        self._genre_keys = {}
+    
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['movie_genres'] = {}
+        state['_genre_keys'] = {}
+        return state
+    
+    def _genre_key(self, genres):
+        key = tuple(genres)
+        return self._genre_keys.setdefault(key, key)
+    
+    def _sketch(self, sketches, key, factory):
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = factory()
+        return sketch
+    
+    def _update_distinct(self, total, per_movie, per_genre, values, movie_ids):
+        hashes = {value: _hash64(value) for value in set(values)}
+        for h in hashes.values():
+            total.add_hash(h)
+        movie_registers = {value: _hll_register(h, MOVIE_HLL_PRECISION) for value, h in hashes.items()}
+        get_genres = self.movie_genres.get
+        genre_pairs = set()
+        for value, movie_id in zip(values, movie_ids):
+            sketch = per_movie.get(movie_id)
+            if sketch is None:
+                sketch = per_movie[movie_id] = HyperLogLog(MOVIE_HLL_PRECISION)
+            sketch.add_register(*movie_registers[value])
+            genres = get_genres(movie_id)
+            if genres:
+                genre_pairs.add((self._genre_key(genres), value))
+        genre_registers = {}
+        for genre, value in {(genre, value) for genres, value in genre_pairs for genre in genres}:
+            register = genre_registers.get(value)
+            if register is None:
+                register = genre_registers[value] = _hll_register(hashes[value], GENRE_HLL_PRECISION)
+            self._sketch(per_genre, genre, lambda: HyperLogLog(GENRE_HLL_PRECISION)).add_register(*register)
+    
+    def update_ratings(self, chunk):
+        user_ids, movie_ids, values = chunk[0], chunk[1], chunk[2]
+        self._update_distinct(self.users, self.movie_users, self.genre_users, user_ids, movie_ids)
+        get_genres = self.movie_genres.get
+        for value, count in Counter(values).items():
+            self.rating_quantiles.add(value, count)
+        genre_values = Counter(zip(map(self._genre_key, map(get_genres, movie_ids, repeat(()))), values))
+        for (genres, value), count in genre_values.items():
+            for genre in genres:
+                self._sketch(self.genre_quantiles, genre, QuantileSketch).add(value, count)
+        self.n_ratings += len(values)
+        return self
+    
+    def update_tags(self, chunk):
+        movie_ids, tags = chunk[1], chunk[2]
+        self._update_distinct(self.tag_names, self.movie_tags, self.genre_tags, tags, movie_ids)
+        for tag, count in Counter(tags).items():
+            self.tag_counts.add(tag, count)
+        self.n_tags += len(tags)
+        return self
+    
+    def add_ratings(self, ratings, chunk_size=DEFAULT_CHUNK_ROWS):
+        for columns in ((ratings.user_ids, ratings.movie_ids, ratings.values), ratings.delta):
+            for start in range(0, len(columns[2]), chunk_size):
+                self.update_ratings([column[start:start + chunk_size] for column in columns[:3]])
+        return self
+    
+    def add_tags(self, tags, chunk_size=DEFAULT_CHUNK_ROWS):
+        movie_ids = _record_column(tags.get_tags(), 'movieId')
+        names = _record_column(tags.get_tags(), 'tag')
+        while True:
+            part = list(islice(movie_ids, chunk_size)), list(islice(names, chunk_size))
+            if not part[0]:
+                return self
+            self.update_tags((None,) + part)
+    
+    def merge(self, other):
+        self.n_ratings += other.n_ratings
+        self.n_tags += other.n_tags
+        self.users.merge(other.users)
+        self.tag_names.merge(other.tag_names)
+        self.rating_quantiles.merge(other.rating_quantiles)
+        self.tag_counts.merge(other.tag_counts)
+        for mine, theirs in ((self.movie_users, other.movie_users), (self.movie_tags, other.movie_tags),
+                             (self.genre_users, other.genre_users), (self.genre_tags, other.genre_tags),
+                             (self.genre_quantiles, other.genre_quantiles)):
+            for key, sketch in theirs.items():
+                if key in mine:
+                    mine[key].merge(sketch)
                 else:
-                    continue
-                movie_scores.append((movie, score))
-        return sorted(movie_scores, key=lambda x: x[1], reverse=True)[:n]
+                    mine[key] = copy.deepcopy(sketch)
+        return self
+    
+    def save(self, path, source=None):
+        genres = sorted(set(self.genre_users) | set(self.genre_tags) | set(self.genre_quantiles))
+        empty = HyperLogLog(GENRE_HLL_PRECISION)
+        header = {'kind': type(self).__name__, 'source': source, 'genres': genres,
+                  'n_ratings': self.n_ratings, 'n_tags': self.n_tags,
+                  'rating_quantiles': self.rating_quantiles.to_dict(),
+                  'genre_quantiles': {genre: sketch.to_dict() for genre, sketch in self.genre_quantiles.items()},
+                  'tag_counts': {'width': self.tag_counts.width, 'depth': self.tag_counts.depth,
+                                 'top': self.tag_counts.top, 'total': self.tag_counts.total,
+                                 'candidates': list(self.tag_counts.candidates.items())}}
+        families = {'totals': [self.users, self.tag_names],
+                    'movieUsers': list(self.movie_users.values()),
+                    'movieTags': list(self.movie_tags.values()),
+                    'genreUsers': [self.genre_users.get(genre, empty) for genre in genres],
+                    'genreTags': [self.genre_tags.get(genre, empty) for genre in genres]}
+        sections = {'movieUsersKeys': array('i', self.movie_users),
+                    'movieTagsKeys': array('i', self.movie_tags),
+                    'tagCounts': self.tag_counts.table}
+        for name, sketches in families.items():
+            sections.update(zip((name + 'Lengths', name + 'Indexes', name + 'Ranks'), _pack_hlls(sketches)))
+        return _write_sections(path, header, sections)
+    
+    @classmethod
+    def load(cls, path, source=None):
+        expected = {'kind': cls.__name__}
+        if source is not None:
+            expected['source'] = source
+        loaded = _read_sections(path, **expected)
+        if loaded is None:
+            return None
+        header, sections, _ = loaded
+        families = {name: _unpack_hlls(sections[name + 'Lengths'], sections[name + 'Indexes'],
+                                       sections[name + 'Ranks'], precision)
+                    for name, precision in (('totals', HLL_PRECISION), ('movieUsers', MOVIE_HLL_PRECISION),
+                                            ('movieTags', MOVIE_HLL_PRECISION),
+                                            ('genreUsers', GENRE_HLL_PRECISION), ('genreTags', GENRE_HLL_PRECISION))}
+        sketches = cls()
+        sketches.n_ratings, sketches.n_tags = header['n_ratings'], header['n_tags']
+        sketches.users, sketches.tag_names = families['totals']
+        sketches.movie_users = dict(zip(sections['movieUsersKeys'].tolist(), families['movieUsers']))
+        sketches.movie_tags = dict(zip(sections['movieTagsKeys'].tolist(), families['movieTags']))
+        genres = header['genres']
+        sketches.genre_users = {genre: sketch for genre, sketch in zip(genres, families['genreUsers'])
+                               if sketch.registers is not None or sketch.sparse}
+        sketches.genre_tags = {genre: sketch for genre, sketch in zip(genres, families['genreTags'])
+                               if sketch.registers is not None or sketch.sparse}
+        sketches.rating_quantiles = QuantileSketch.from_dict(header['rating_quantiles'])
+        sketches.genre_quantiles = {genre: QuantileSketch.from_dict(state)
+                                    for genre, state in header['genre_quantiles'].items()}
+        counts = header['tag_counts']
+        sketches.tag_counts = CountMinSketch(counts['width'], counts['depth'], counts['top'])
+        sketches.tag_counts.table = _copy_column(sections['tagCounts'])
+        sketches.tag_counts.total = counts['total']
+        sketches.tag_counts.candidates = dict(counts['candidates'])
+        return sketches
+    
+    def _lookup(self, sketches, movie_id, genre):
+        if genre is not None:
+            return sketches[1].get(genre)
+        try:
+            return sketches[0].get(int(movie_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def get_distinct_users(self, movie_id=None, genre=None):
+        if movie_id is None and genre is None:
+            return self.users.count()
+        sketch = self._lookup((self.movie_users, self.genre_users), movie_id, genre)
+        return 0 if sketch is None else sketch.count()
+    
+    def get_distinct_tags(self, movie_id=None, genre=None):
+        if movie_id is None and genre is None:
+            return self.tag_names.count()
+        sketch = self._lookup((self.movie_tags, self.genre_tags), movie_id, genre)
+        return 0 if sketch is None else sketch.count()
+    
+    def get_rating_quantiles(self, quantiles=SKETCH_QUANTILES, genre=None):
+        sketch = self.rating_quantiles if genre is None else self.genre_quantiles.get(genre)
+        if sketch is None:
+            return [(q, None) for q in quantiles]
+        return [(q, sketch.quantile(q)) for q in quantiles]
+    
+    def get_top_tags(self, n=10):
+        return self.tag_counts.heavy_hitters(n)
+    
+    def get_genre_summary(self, n=None):
+        genres = heapq.nlargest(len(self.genre_users) if n is None else n, self.genre_users,
+                                key=lambda genre: (self.genre_users[genre].count(), genre))
+        return [{'genre': genre,
+                 'users': self.get_distinct_users(genre=genre),
+                 'tags': self.get_distinct_tags(genre=genre),
+                 'median': self.genre_quantiles[genre].quantile(0.5) if genre in self.genre_quantiles else None}
+                for genre in genres]
+
+_sketch_genres = None
+_sketch_chunk_rows = DEFAULT_CHUNK_ROWS
+
+def _init_sketch_worker(movie_genres, chunk_rows):
+    global _sketch_genres, _sketch_chunk_rows
+    _sketch_genres = movie_genres
+    _sketch_chunk_rows = chunk_rows
+
+def _sketch_rating_range(byte_range):
+    path, start, end = byte_range
+    sketches = DatasetSketches()
+    sketches.movie_genres = _sketch_genres
+    for chunk in _rating_line_chunks(_iter_range(path, start, end), _sketch_chunk_rows, 1, f" of bytes {start}-{end}"):
+        sketches.update_ratings(chunk)
+    return sketches
+
+def sketch_dataset(ratings_source, tags_source=None, movies_obj=None, chunk_size=None, max_memory=None, workers=1):
+    sketches = DatasetSketches(movies_obj)
+    path = _resolve_path(ratings_source) if isinstance(ratings_source, str) else None
+    if workers > 1 and path is not None and _is_plain(path):
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sketch_worker,
+                                 initargs=(sketches.movie_genres,
+                                           _chunk_rows(chunk_size, max_memory, RATING_ROW_BYTES))) as pool:
+            for part in pool.map(_sketch_rating_range, _byte_ranges(path, workers * 4)):
+                sketches.merge(part)
+    else:
+        for chunk in iter_rating_chunks(ratings_source, chunk_size, max_memory):
+            sketches.update_ratings(chunk)
+    if tags_source is not None:
+        for chunk in iter_tag_chunks(tags_source, chunk_size, max_memory):
+            sketches.update_tags(chunk)
+    return sketches
+
+_similarity_state = None
+
+def _init_similarity_worker(state):
+    global _similarity_state
+    _similarity_state = state
+
+def _similarity_block(block):
+    item_offsets, item_users, item_values, user_offsets, user_items, user_values, norms, k, min_support = _similarity_state
+    first, last = block
+    neighbors = []
+    for item in range(first, last):
+        dots = {}
+        support = Counter()
+        for user, weight in zip(item_users[item_offsets[item]:item_offsets[item + 1]],
+                                item_values[item_offsets[item]:item_offsets[item + 1]]):
+            start, end = user_offsets[user], user_offsets[user + 1]
+            items = user_items[start:end]
+            support.update(items)
+            for other, value in zip(items, user_values[start:end]):
+                dots[other] = dots.get(other, 0.0) + weight * value
+        norm = norms[item]
+        scores = []
+        for other, dot in dots.items():
+            if other != item and support[other] >= min_support and norm and norms[other]:
+                scores.append((dot / (norm * norms[other]), other))
+        neighbors.append(heapq.nlargest(k, scores))
+    return neighbors
+
+class ItemSimilarity:
+    def __init__(self, movie_keys, offsets, neighbor_ids, scores, method='cosine', k=20, source=None):
+        self.movie_keys = movie_keys
+        self.offsets = offsets
+        self.neighbor_ids = neighbor_ids
+        self.scores = scores
+        self.method = method
+        self.k = k
+        self.source = source
+        self.movieid_to_slot = {movie_id: slot for slot, movie_id in enumerate(movie_keys)}
+    
+    @classmethod
+    def build(cls, ratings, k=20, method='cosine', min_support=3, max_user_ratings=200,
+              workers=1, block_size=256, source=None):
+        if method not in ('cosine', 'adjusted_cosine'):
+            raise ValueError(f"Unknown similarity method: {method}")
+        ratings.compact()
+        user_keys, user_index_offsets, user_perm, _ = ratings.get_user_index()
+        position_movies, values = ratings.movie_ids, ratings.values
+        entry_users, entry_movies, entry_values = array('i'), array('i'), array('d')
+        user_offsets = array('q', [0])
+        for user in range(len(user_keys)):
+            start, end = user_index_offsets[user], user_index_offsets[user + 1]
+            if max_user_ratings:
+                start = max(start, end - max_user_ratings)
+            positions = user_perm[start:end]
+            user_values = list(map(values.__getitem__, positions))
+            if method == 'adjusted_cosine':
+                mean = sum(user_values) / len(user_values)
+                user_values = [value - mean for value in user_values]
+            entry_users.extend(repeat(user, len(positions)))
+            entry_movies.extend(map(position_movies.__getitem__, positions))
+            entry_values.extend(user_values)
+            user_offsets.append(len(entry_values))
+        movie_keys, item_offsets, item_perm = _counting_sort(entry_movies)
+        item_slot = {movie_id: slot for slot, movie_id in enumerate(movie_keys)}
+        user_items = array('i', map(item_slot.__getitem__, entry_movies))
+        item_users = _take(entry_users, item_perm)
+        item_values = _take(entry_values, item_perm)
+        norms = array('d', (math.sqrt(sum(map(mul, item_values[item_offsets[i]:item_offsets[i + 1]],
+                                              item_values[item_offsets[i]:item_offsets[i + 1]])))
+                            for i in range(len(movie_keys))))
+        state = (item_offsets, item_users, item_values, user_offsets, user_items, entry_values,
+                 norms, k, min_support)
+        blocks = [(first, min(first + block_size, len(movie_keys)))
+                  for first in range(0, len(movie_keys), block_size)]
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_similarity_worker,
+                                     initargs=(state,)) as pool:
+                results = list(pool.map(_similarity_block, blocks))
+        else:
+            _init_similarity_worker(state)
+            try:
+                results = [_similarity_block(block) for block in blocks]
+            finally:
+                _init_similarity_worker(None)
+        offsets, neighbor_ids, scores = array('q', [0]), array('i'), array('d')
+        for block_neighbors in results:
+            for neighbors in block_neighbors:
+                neighbor_ids.extend(movie_keys[other] for _, other in neighbors)
+                scores.extend(score for score, _ in neighbors)
+                offsets.append(len(scores))
+        return cls(movie_keys, offsets, neighbor_ids, scores, method, k, source)
+    
+    def save(self, path):
+        header = {'kind': type(self).__name__, 'method': self.method, 'k': self.k, 'source': self.source}
+        return _write_sections(path, header, {'movieKeys': self.movie_keys, 'offsets': self.offsets,
+                                              'neighborIds': self.neighbor_ids, 'scores': self.scores})
+    
+    @classmethod
+    def load(cls, path, source=None):
+        expected = {'kind': cls.__name__}
+        if source is not None:
+            expected['source'] = source
+        loaded = _read_sections(path, **expected)
+        if loaded is None:
+            return None
+        header, sections, mapped = loaded
+        similarity = cls(sections['movieKeys'], sections['offsets'], sections['neighborIds'],
+                         sections['scores'], header['method'], header['k'], header['source'])
+        similarity._snapshot = mapped
+        return similarity
+    
+    def similar(self, movie_id, k=None):
+        try:
+            slot = self.movieid_to_slot.get(int(movie_id))
+        except (TypeError, ValueError):
+            return []
+        if slot is None:
+            return []
+        start, end = self.offsets[slot], self.offsets[slot + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return list(zip(self.neighbor_ids[start:end], self.scores[start:end]))
+
+class TagIndex:
+    NGRAM = 3
+    TOKEN_RE = re.compile(r'\w+')
+    
+    def __init__(self):
+        self.postings = {}
+        self.terms = []
+        self.ngrams = {}
+    
+    def tokenize(self, text):
+        return self.TOKEN_RE.findall(text.lower())
+    
+    def _grams(self, term):
+        for size in range(1, min(self.NGRAM, len(term)) + 1):
+            for i in range(len(term) - size + 1):
+                yield term[i:i + size]
+    
+    def add(self, movie_id, tag):
+        for term in set(self.tokenize(tag)):
+            posting = self.postings.get(term)
+            if posting is None:
+                term = sys.intern(term)
+                posting = self.postings[term] = {}
+                insort(self.terms, term)
+                for gram in self._grams(term):
+                    self.ngrams.setdefault(gram, set()).add(term)
+            posting[movie_id] = posting.get(movie_id, 0) + 1
+    
+    def _match_terms(self, token, mode):
+        if mode == 'exact':
+            return [token] if token in self.postings else []
+        if mode == 'prefix':
+            matched = []
+            for i in range(bisect_left(self.terms, token), len(self.terms)):
+                if not self.terms[i].startswith(token):
+                    break
+                matched.append(self.terms[i])
+            return matched
+        if len(token) <= self.NGRAM:
+            return self.ngrams.get(token, ())
+        grams = sorted((self.ngrams.get(token[i:i + self.NGRAM], set())
+                        for i in range(len(token) - self.NGRAM + 1)), key=len)
+        return [term for term in grams[0].intersection(*grams[1:]) if token in term]
+    
+    def search(self, query, mode='substring', limit=None):
+        scores = None
+        for token in self.tokenize(query):
+            matched = {}
+            for term in self._match_terms(token, mode):
+                for movie_id, count in self.postings[term].items():
+                    matched[movie_id] = matched.get(movie_id, 0) + count
+            if scores is None:
+                scores = matched
+            else:
+                scores = {movie_id: min(scores[movie_id], count)
+                          for movie_id, count in matched.items() if movie_id in scores}
+        if not scores:
+            return []
+        rank = lambda item: (-item[1], item[0])
+        if limit is not None:
+            return heapq.nsmallest(limit, scores.items(), key=rank)
+        return sorted(scores.items(), key=rank)
 
 class Tags:
-    def __init__(self, source, movies_obj):
+    def __init__(self, source, movies_obj, cache=False, workers=1):
         self.tags = []
         self.movies_obj = movies_obj
-        self.movieid_to_tags = {}
-        self.title_to_tags = {}
+        self.workers = workers
+        self.movieid_to_tags = _RecordGroups(self.tags)
+        self.rejected = Counter()
+        self._tag_index = None
+        self._time_order = None
+        self._title_to_tags = None
         try:
-            if isinstance(source, str):
-                import os
-                tried_paths = [source]
-                f = None
-                try:
-                    f = open(source, 'r', encoding='utf-8')
-                except FileNotFoundError:
-                    alt_path = os.path.join(os.path.pardir, source)
-                    tried_paths.append(alt_path)
-                    try:
-                        f = open(alt_path, 'r', encoding='utf-8')
-                    except FileNotFoundError:
-                        script_dir = os.path.dirname(os.path.abspath(__file__))
-                        alt_path2 = os.path.join(script_dir, source)
-                        tried_paths.append(alt_path2)
-                        try:
-                            f = open(alt_path2, 'r', encoding='utf-8')
-                        except FileNotFoundError:
-                            raise FileNotFoundError(f"Не найден файл {source}. Пробовал пути: {tried_paths}")
-                with f:
-                    self._load_data(f)
-            else:
-                self._load_data(source)
+            _load_source(self, source, cache)
         except (IOError, OSError) as e:
             raise Exception(f"Failed to load tags data: {str(e)}")
     
     def _load_data(self, file_obj):
         try:
-            next(file_obj)
-            for i, line in enumerate(file_obj):
-                try:
-                    parts = line.strip().split(',')
-                    if len(parts) < 4:
-                        continue
-                    userId, movieId, tag, timestamp = parts
-                    t = {'userId': userId, 'movieId': movieId, 'tag': tag, 'timestamp': int(timestamp)}
-                    self.tags.append(t)
-                    self.movieid_to_tags.setdefault(movieId, []).append(t)
-                    movie = self.movies_obj.get_movie(movieId)
-                    if movie:
-                        self.title_to_tags.setdefault(movie['title'].lower(), []).append(t)
-                except ValueError as e:
-                    raise Exception(f"Invalid data format in line {i+2}: {str(e)}")
+            for chunk in iter_tag_chunks(file_obj, rejected=self.rejected):
+                self._add_chunk(chunk)
+        except Exception as e:
+            raise Exception(f"Error loading tags data: {str(e)}")
+    
+    def _load_parallel(self, path):
+        try:
+            for chunk, rejected in _parse_parallel(path, _parse_tag_range, self.workers, quoted=True):
+                self._add_chunk(chunk)
+                self.rejected.update(rejected)
         except Exception as e:
             raise Exception(f"Error loading tags data: {str(e)}")
     
+    def _row_count(self):
+        return len(self.tags)
+    
+    def _add_chunk(self, chunk):
+        for userId, movieId, tag, timestamp in zip(*chunk):
+            self._add_tag(userId, movieId, tag, timestamp)
+    
+    def _add_tag(self, userId, movieId, tag, timestamp):
+        t = Tag(userId, movieId, sys.intern(tag), timestamp)
+        self.tags.append(t)
+        position = len(self.tags) - 1
+        self._time_order = None
+        if self._tag_index is not None:
+            self._tag_index.add(movieId, t.tag)
+        self.movieid_to_tags.add(movieId, position)
+        if self._title_to_tags is not None:
+            movie = self.movies_obj.movieid_to_movie.get(movieId)
+            if movie:
+                self._title_to_tags.add(movie['title'].lower(), position)
+    
+    @property
+    def title_to_tags(self):
+        if self._title_to_tags is None:
+            groups = {}
+            get_movie = self.movies_obj.movieid_to_movie.get
+            for movie_id, positions in self.movieid_to_tags.group_items():
+                movie = get_movie(movie_id)
+                if movie:
+                    groups.setdefault(movie.title.lower(), []).extend(positions)
+            self._title_to_tags = _RecordGroups(self.tags, groups)
+        return self._title_to_tags
+
+    def append(self, rows):
+        count = len(self.tags)
+        for row in rows:
+            if isinstance(row, (dict, _Record)):
+                row = row['userId'], row['movieId'], row['tag'], row['timestamp']
+            self._add_tag(int(row[0]), int(row[1]), row[2], int(row[3]))
+        return len(self.tags) - count
+
+    def ingest_delta(self, source, chunk_size=None):
+        count = len(self.tags)
+        try:
+            for chunk in iter_tag_chunks(source, chunk_size, rejected=self.rejected):
+                self._add_chunk(chunk)
+        except (IOError, OSError) as e:
+            raise Exception(f"Failed to load tags delta: {str(e)}")
+        return len(self.tags) - count
+
+    def tail(self, source, offset=None, poll_interval=1.0, polls=None):
+        for lines, offset in tail_csv(source, offset, poll_interval, polls):
+            count = len(self.tags)
+            for chunk in _tag_line_chunks(lines, DEFAULT_CHUNK_ROWS, self.rejected, header=False):
+                self._add_chunk(chunk)
+            yield len(self.tags) - count, offset
+
+    def _snapshot_sections(self):
+        tags, tag_offsets = _pack_string_column(t.tag for t in self.tags)
+        group_keys, group_offsets, group_perm = array('i'), array('q', [0]), array('q')
+        for movie_id, positions in self.movieid_to_tags.group_items():
+            group_keys.append(movie_id)
+            group_perm.extend(positions)
+            group_offsets.append(len(group_perm))
+        return {'userId': array('i', (t.userId for t in self.tags)),
+                'movieId': array('i', (t.movieId for t in self.tags)),
+                'tag': tags, 'tagOffsets': tag_offsets,
+                'timestamp': array('q', (t.timestamp for t in self.tags)),
+                'groupKeys': group_keys, 'groupOffsets': group_offsets, 'groupPerm': group_perm,
+                'rejected': _pack_counter(self.rejected)}
+    
+    def _restore_snapshot(self, sections):
+        self.rejected = _unpack_counter(sections['rejected'])
+        user_ids, movie_ids, timestamps = sections['userId'], sections['movieId'], sections['timestamp']
+        tags = _StringColumn(sections['tag'], sections['tagOffsets'])
+        build = lambda position: Tag(user_ids[position], movie_ids[position], tags[position], timestamps[position])
+        self.tags = _LazyRecords(len(timestamps), build, {'userId': user_ids, 'movieId': movie_ids,
+                                                          'tag': tags, 'timestamp': timestamps})
+        keys = sections['groupKeys']
+        self.movieid_to_tags = _RecordGroups(self.tags, dict(zip(keys, range(len(keys)))),
+                                             sections['groupOffsets'], sections['groupPerm'])
+    
     def get_tags(self):
         return self.tags
     
+    @_timed
     def get_movie_tags(self, movie_id):
-        return self.movieid_to_tags.get(str(movie_id), [])
+        try:
+            return self.movieid_to_tags.get(int(movie_id), [])
+        except (TypeError, ValueError):
+            return []
     
+    @_timed
     def get_tags_by_title(self, title):
         return self.title_to_tags.get(title.lower(), [])
-
-TEST_MOVIES_DATA = """movieId,title,genres
-1,Toy Story (1995),Adventure|Animation|Children|Comedy|Fantasy
-2,Jumanji (1995),Adventure|Children|Fantasy
-3,Grumpier Old Men (1995),Comedy|Romance"""
-
-TEST_RATINGS_DATA = """userId,movieId,rating,timestamp
-1,1,4.5,1147880044
-1,2,3.0,1147880044
-2,1,5.0,1147880044"""
-
-TEST_TAGS_DATA = """userId,movieId,tag,timestamp
-1,1,pixar,1147880044
-2,1,animation,1147880044
-3,2,fantasy,1147880044"""
-
-TEST_LINKS_DATA = """movieId,imdbId,tmdbId
-1,114709,862
-2,113497,8844
-3,113228,15602"""
-
-@pytest.fixture
-def setup_classes():
-    test_files = {
-        'test_movies.csv': TEST_MOVIES_DATA,
-        'test_ratings.csv': TEST_RATINGS_DATA,
-        'test_tags.csv': TEST_TAGS_DATA,
-        'test_links.csv': TEST_LINKS_DATA
-    }
     
+    def get_tag_index(self):
+        if self._tag_index is None:
+            with _phase('Tags.index'):
+                index = TagIndex()
+                for movie_id, tag in zip(_record_column(self.tags, 'movieId'), _record_column(self.tags, 'tag')):
+                    index.add(movie_id, tag)
+            self._tag_index = index
+        return self._tag_index
+    
+    @_timed
+    def search_tags(self, query, mode='substring', limit=None):
+        return self.get_tag_index().search(query, mode, limit)
+    
+    def _get_time_order(self):
+        if self._time_order is None:
+            tags = sorted(self.tags, key=lambda t: t.timestamp)
+            self._time_order = (array('q', (t.timestamp for t in tags)), tags)
+        return self._time_order
+    
+    @_timed
+    def get_tags_between(self, period):
+        start, end = _period_range(period)
+        times, tags = self._get_time_order()
+        return tags[bisect_left(times, start):bisect_left(times, end)]
+    
+    @_timed
+    def trending_tags(self, n=10, window=30 * DAY, now=None):
+        times, tags = self._get_time_order()
+        if not tags:
+            return []
+        if now is None:
+            now = times[-1] + 1
+        previous, current, last = (bisect_left(times, t) for t in (now - 2 * window, now - window, now))
+        counts = Counter(t.tag for t in tags[current:last])
+        counts.subtract(t.tag for t in tags[previous:current])
+        return [(tag, count) for tag, count in counts.most_common(n) if count > 0]
+
+CATALOG_FIELDS = [('movieId', 'int32'), ('title', 'string'), ('genres', 'string'), ('year', 'int32'),
+                  ('imdbId', 'string'), ('tmdbId', 'string'), ('imdb_url', 'string'), ('tmdb_url', 'string')]
+RATING_FIELDS = [('rating_count', 'int64'), ('rating_mean', 'float64'), ('rating_median', 'float64')]
+
+def iter_catalog_chunks(movies, links, ratings=None, chunk_size=DEFAULT_CHUNK_ROWS):
+    catalog = movies.get_movies()
+    for start in range(0, len(catalog), chunk_size):
+        chunk = catalog[start:start + chunk_size]
+        movie_ids = [movie.movieId for movie in chunk]
+        columns = {'movieId': movie_ids,
+                   'title': [movie.title for movie in chunk],
+                   'genres': ['|'.join(movie.genres) for movie in chunk],
+                   'year': [movie.year for movie in chunk]}
+        columns.update(links.get_links_batch(movie_ids))
+        if ratings is not None:
+            columns.update(ratings.get_aggregates_batch(movie_ids))
+        yield columns
+
+def _write_catalog_csv(path, chunks, fields):
+    rows = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in fields])
+        for columns in chunks:
+            writer.writerows(zip(*columns.values()))
+            rows += len(columns['movieId'])
+    return rows
+
+def _write_catalog_parquet(path, chunks, fields):
     try:
-        for filename, content in test_files.items():
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(content)
-        
-        movies = Movies('test_movies.csv')
-        ratings = Ratings('test_ratings.csv', movies)
-        tags = Tags('test_tags.csv', movies)
-        links = Links('test_links.csv', movies)
-        
-        yield movies, ratings, tags, links
-    finally:
-        for filename in test_files:
-            try:
-                os.remove(filename)
-            except OSError:
-                pass
-
-def test_movies_types(setup_classes):
-    movies, _, _, _ = setup_classes
-    
-    movies_list = movies.get_movies()
-    assert isinstance(movies_list, list)
-    assert all(isinstance(movie, dict) for movie in movies_list)
-    assert len(movies_list) == 3
-    
-    movie = movies.get_movie(1)
-    assert isinstance(movie, dict)
-    assert movie['title'] == 'Toy Story (1995)'
-    
-    genres = movies.get_genres()
-    assert isinstance(genres, list)
-    assert all(isinstance(genre, str) for genre in genres)
-    assert genres == sorted(genres)
-    assert 'Adventure' in genres
-
-def test_ratings_types(setup_classes):
-    _, ratings, _, _ = setup_classes
-    
-    ratings_list = ratings.get_ratings()
-    assert isinstance(ratings_list, list)
-    assert all(isinstance(rating, dict) for rating in ratings_list)
-    assert len(ratings_list) == 3
-    
-    movie_ratings = ratings.get_movie_ratings(1)
-    assert isinstance(movie_ratings, list)
-    assert len(movie_ratings) == 2
-    
-    avg_rating = ratings.get_average_rating(1)
-    assert isinstance(avg_rating, float)
-    assert avg_rating == 4.75
-
-def test_tags_types(setup_classes):
-    _, _, tags, _ = setup_classes
-    
-    tags_list = tags.get_tags()
-    assert isinstance(tags_list, list)
-    assert all(isinstance(tag, dict) for tag in tags_list)
-    assert len(tags_list) == 3
-    
-    movie_tags = tags.get_movie_tags(1)
-    assert isinstance(movie_tags, list)
-    assert len(movie_tags) == 2
-    
-    common_tags = tags.get_tags_by_title('toy story (1995)')
-    assert isinstance(common_tags, list)
-    assert all(isinstance(tag, dict) for tag in common_tags)
-    assert all(isinstance(tag['tag'], str) for tag in common_tags)
-
-def test_links_types(setup_classes):
-    _, _, _, links = setup_classes
-    
-    links_list = links.get_links()
-    assert isinstance(links_list, list)
-    assert all(isinstance(link, dict) for link in links_list)
-    assert len(links_list) == 3
-    
-    movie_links = links.get_movie_links(1)
-    assert isinstance(movie_links, dict)
-    assert movie_links['imdbId'] == '114709'
-    
-    imdb_link = links.get_imdb_link(1)
-    assert isinstance(imdb_link, str)
-    assert imdb_link == 'https://www.imdb.com/title/tt0114709/'
-
-def test_error_handling(setup_classes):
-    movies, ratings, tags, links = setup_classes
-    
-    assert movies.get_movie("invalid") is None
-    assert ratings.get_movie_ratings("invalid") == []
-    assert tags.get_movie_tags("invalid") == []
-    assert links.get_movie_links("invalid") is None
-    assert tags.get_tags_by_title("invalid") == []
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Parquet export requires the pyarrow package")
+    schema = pyarrow.schema([(name, getattr(pyarrow, kind)()) for name, kind in fields])
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for columns in chunks:
+            writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+            rows += len(columns['movieId'])
+    return rows
 
-if __name__ == "__main__":
-    import sys
-    from datetime import datetime
-    from collections import Counter
-    import os
-    
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print("python movielens_analysis.py top [N] [mean|median]")
-        print("python movielens_analysis.py movie [ID|TITLE]")
-        print("python movielens_analysis.py genre [GENRE]")
-        print("python movielens_analysis.py year [YEAR]")
-        print("python movielens_analysis.py user [USER_ID]")
-        print("python movielens_analysis.py tag [TAG]")
-        print("python movielens_analysis.py imdb [ID|TITLE]")
-        print("python movielens_analysis.py stats")
-        print("python movielens_analysis.py years")
-        sys.exit(1)
-        
-    command = sys.argv[1]
-    movies = Movies('datasets/ml-latest-small/movies.csv')
-    ratings = Ratings('datasets/ml-latest-small/ratings.csv', movies)
-    tags = Tags('datasets/ml-latest-small/tags.csv', movies)
-    links = Links('datasets/ml-latest-small/links.csv', movies)
+def export_catalog(path, movies, links, ratings=None, format=None, chunk_size=DEFAULT_CHUNK_ROWS):
+    format = format or ('parquet' if path.endswith('.parquet') else 'csv')
+    chunks = iter_catalog_chunks(movies, links, ratings, chunk_size)
+    fields = CATALOG_FIELDS + (RATING_FIELDS if ratings is not None else [])
+    if format == 'csv':
+        return _write_catalog_csv(path, chunks, fields)
+    if format == 'parquet':
+        return _write_catalog_parquet(path, chunks, fields)
+    raise ValueError(f"Unknown export format: {format}")
+
+DATASET_DIR = os.environ.get('MOVIELENS_DATA', 'datasets/ml-latest-small')
+SERVER_ADDRESS = os.environ.get('MOVIELENS_SERVER', '127.0.0.1:8765')
+CLI_ONLY_COMMANDS = ('export', 'serve')
+
+USAGE = [
+    "Usage:",
+    "python movielens_analysis.py top [N] [mean|median|bayesian|count] [MIN_COUNT]",
+    "python movielens_analysis.py movie [ID|TITLE]",
+    "python movielens_analysis.py genre [GENRE]",
+    "python movielens_analysis.py year [YEAR]",
+    "python movielens_analysis.py filter [genre=A,B] [years=1990-1999] [decade=1990] [min_rating=4] [min_count=20] [sort=mean|median|count|none] [n=20]",
+    "python movielens_analysis.py user [USER_ID]",
+    "python movielens_analysis.py tag [TAG]",
+    "python movielens_analysis.py imdb [ID|TITLE]",
+    "python movielens_analysis.py export [PATH.csv|PATH.parquet]",
+    "python movielens_analysis.py similar [ID|TITLE] [K]",
+    "python movielens_analysis.py window [ID|TITLE] [YYYY|YYYY-MM|YYYY-MM-DD]",
+    "python movielens_analysis.py trending [N] [decay|delta] [DAYS]",
+    "python movielens_analysis.py stats (approximate distinct counts, quantiles and top tags from sketches)",
+    "python movielens_analysis.py years",
+    "python movielens_analysis.py serve [HOST:PORT]",
+    "Add --stream to top/stats to aggregate ratings.csv in bounded memory",
+    "Add --local to skip a running server and load the data in-process",
+    "Add --profile to print load and query timings, or --profile=FILE to also write cProfile stats",
+]
+
+class MovieLensDataset:
+    def __init__(self, directory=DATASET_DIR, cache=True):
+        self.directory = directory
+        self.cache = cache
+        self._movies = None
+        self._ratings = None
+        self._tags = None
+        self._links = None
+        self._similarity = None
+        self._sketches = None
+        self._build_lock = threading.RLock()
+    
+    def path(self, name):
+        return os.path.join(self.directory, name)
+    
+    def _build(self, name, build):
+        value = getattr(self, name)
+        if value is None:
+            with self._build_lock:
+                value = getattr(self, name)
+                if value is None:
+                    value = build()
+                    setattr(self, name, value)
+        return value
+    
+    @property
+    def movies(self):
+        return self._build('_movies', lambda: Movies(self.path('movies.csv'), cache=self.cache))
+    
+    @property
+    def ratings(self):
+        return self._build('_ratings', lambda: Ratings(self.path('ratings.csv'), self.movies, cache=self.cache))
+    
+    @property
+    def tags(self):
+        return self._build('_tags', lambda: Tags(self.path('tags.csv'), self.movies, cache=self.cache))
+    
+    @property
+    def links(self):
+        return self._build('_links', lambda: Links(self.path('links.csv'), self.movies, cache=self.cache))
+    
+    def load(self):
+        self.movies, self.ratings, self.tags, self.links
+        return self
+    
+    def get_similarity(self):
+        return self._build('_similarity', self._build_similarity)
+    
+    def _build_similarity(self):
+        ratings_path = _resolve_path(self.path('ratings.csv'))
+        source = _source_key(ratings_path)
+        similarity = ItemSimilarity.load(_sidecar_path(ratings_path, '.similarity'), source) if self.cache else None
+        if similarity is None:
+            with _phase('ItemSimilarity.build'):
+                similarity = ItemSimilarity.build(self.ratings, source=source, workers=os.cpu_count() or 1)
+            if self.cache:
+                similarity.save(_sidecar_path(ratings_path, '.similarity'))
+        return similarity
+    
+    def get_sketches(self):
+        return self._build('_sketches', self._build_sketches)
+    
+    def _build_sketches(self):
+        ratings_path = _resolve_path(self.path('ratings.csv'))
+        source = {'ratings': _source_key(ratings_path), 'tags': _source_key(_resolve_path(self.path('tags.csv')))}
+        sketches = DatasetSketches.load(_sidecar_path(ratings_path, '.sketches'), source) if self.cache else None
+        if sketches is None:
+            with _phase('DatasetSketches.build'):
+                sketches = DatasetSketches(self.movies).add_ratings(self.ratings).add_tags(self.tags)
+            if self.cache:
+                sketches.save(_sidecar_path(ratings_path, '.sketches'), source)
+        return sketches
+
+def _sketch_lines(sketches, n=5):
+    out = [f"Distinct users: ~{sketches.get_distinct_users()}",
+           f"Distinct tags: ~{sketches.get_distinct_tags()}"]
+    quantiles = sketches.get_rating_quantiles()
+    if sketches.n_ratings:
+        out.append("Rating quantiles: " + ", ".join(f"p{round(q * 100)} {value:.1f}" for q, value in quantiles))
+    top_tags = sketches.get_top_tags(n)
+    if top_tags:
+        out.append("Top tags: " + ", ".join(f"{tag} (~{count})" for tag, count in top_tags))
+    for row in sketches.get_genre_summary(n):
+        median = 'n/a' if row['median'] is None else f"{row['median']:.1f}"
+        out.append(f"{row['genre']}: ~{row['users']} users, ~{row['tags']} tags, median {median}")
+    return out
+
+def run_command(dataset, args):
+    out = []
+    if not args:
+        return list(USAGE), 1
+    command = args[0]
     
     if command == "top":
-        n = int(sys.argv[2]) if len(sys.argv) > 2 else 5
-        method = sys.argv[3] if len(sys.argv) > 3 else 'mean'
-        top = ratings.top_by_ratings(n, method)
+        n = int(args[1]) if len(args) > 1 else 5
+        method = args[2] if len(args) > 2 else 'mean'
+        min_count = int(args[3]) if len(args) > 3 else 1
+        top = dataset.ratings.top_by_ratings(n, method, min_count=min_count)
         for movie, score in top:
-            print(f"{movie['title']} - {method}: {score:.2f}")
+            out.append(f"{movie['title']} - {method}: {score:.2f}")
             
     elif command == "movie":
-        if len(sys.argv) < 3:
-            print("Provide movie ID or title")
-            sys.exit(1)
-        key = sys.argv[2]
-        movie = movies.get_movie(key) or movies.get_movie_by_title(key)
+        if len(args) < 2:
+            return ["Provide movie ID or title"], 1
+        key = args[1]
+        movie = dataset.movies.get_movie(key) or dataset.movies.get_movie_by_title(key)
         if not movie:
-            print("Movie not found")
-            sys.exit(1)
-        print(f"Title: {movie['title']}")
-        print(f"Genres: {movie['genres']}")
-        print(f"Year: {movie['year']}")
-        print(f"Average rating: {ratings.get_average_rating(movie['movieId']):.2f}")
-        print(f"Median rating: {ratings.get_median_rating(movie['movieId']):.2f}")
-        print(f"IMDB: {links.get_imdb_link(movie['movieId'])}")
-        print(f"Tags: {[t['tag'] for t in tags.get_movie_tags(movie['movieId'])]}")
+            return ["Movie not found"], 1
+        out.append(f"Title: {movie['title']}")
+        out.append(f"Genres: {'|'.join(movie['genres'])}")
+        out.append(f"Year: {movie['year']}")
+        out.append(f"Average rating: {dataset.ratings.get_average_rating(movie['movieId']):.2f}")
+        out.append(f"Median rating: {dataset.ratings.get_median_rating(movie['movieId']):.2f}")
+        out.append(f"IMDB: {dataset.links.get_imdb_link(movie['movieId'])}")
+        out.append(f"Tags: {[t['tag'] for t in dataset.tags.get_movie_tags(movie['movieId'])]}")
         
     elif command == "genre":
-        if len(sys.argv) < 3:
-            print("Provide genre")
-            sys.exit(1)
-        genre = sys.argv[2]
-        for movie in movies.get_movies():
-            if genre in movie['genres']:
-                print(f"{movie['title']}")
+        if len(args) < 2:
+            return ["Provide genre"], 1
+        genre = args[1]
+        for movie in dataset.movies.get_movies_by_genre(genre):
+            out.append(f"{movie['title']}")
         
     elif command == "year":
-        if len(sys.argv) < 3:
-            min_year, max_year = movies.get_year_range()
-            print(f"Provide year between {min_year} and {max_year}")
-            sys.exit(1)
-        year = sys.argv[2]
-        found = False
-        count = 0
-        for movie in movies.get_movies():
-            if movie['year'] == year:
-                print(f"{movie['title']}")
-                found = True
-                count += 1
-        if not found:
-            print(f"Нет фильмов за {year}")
+        if len(args) < 2:
+            min_year, max_year = dataset.movies.get_year_range()
+            return [f"Provide year between {min_year} and {max_year}"], 1
+        year = args[1]
+        year_movies = dataset.movies.get_movies_by_year(year)
+        for movie in year_movies:
+            out.append(f"{movie['title']}")
+        count = len(year_movies)
+        if not count:
+            out.append(f"Нет фильмов за {year}")
+        else:
+            out.append(f"Всего фильмов за {year}: {count}")
+        
+    elif command == "filter":
+        options = dict(arg.split('=', 1) for arg in args[1:] if '=' in arg)
+        genres = options['genre'].split(',') if 'genre' in options else None
+        years = options.get('years')
+        decades = [int(decade) for decade in options['decade'].split(',')] if 'decade' in options else None
+        min_rating = float(options['min_rating']) if 'min_rating' in options else None
+        min_count = int(options['min_count']) if 'min_count' in options else None
+        sort = options.get('sort', 'mean')
+        n = int(options.get('n', 20))
+        if sort == 'none' and min_rating is None and min_count is None:
+            results = [(movie, None) for movie in dataset.movies.filter_movies(genres, years, decades)[:n]]
         else:
-            print(f"Всего фильмов за {year}: {count}")
+            results = dataset.ratings.filter_movies(genres, years, decades, min_rating, min_count, sort, n)
+        for movie, score in results:
+            out.append(movie['title'] if score is None else f"{movie['title']} - {sort}: {score:.2f}")
         
     elif command == "user":
-        if len(sys.argv) < 3:
-            print("Provide user ID")
-            sys.exit(1)
-        user_id = sys.argv[2]
-        for r in ratings.get_ratings():
-            if r['userId'] == user_id:
-                movie = movies.get_movie(r['movieId'])
-                if movie:
-                    print(f"{movie['title']}: {r['rating']}")
+        if len(args) < 2:
+            return ["Provide user ID"], 1
+        user_id = args[1]
+        for r in dataset.ratings.get_user_ratings(user_id):
+            movie = dataset.movies.get_movie(r['movieId'])
+            if movie:
+                out.append(f"{movie['title']}: {r['rating']}")
+        profile = dataset.ratings.get_user_profile(user_id)
+        if profile:
+            first = datetime.fromtimestamp(profile['first_timestamp']).date()
+            last = datetime.fromtimestamp(profile['last_timestamp']).date()
+            out.append(f"Ratings: {profile['count']}, mean: {profile['mean']:.2f}, active: {first} - {last}")
+            out.append(f"Favourite genres: {', '.join(genre for genre, _ in profile['favourite_genres'])}")
         
     elif command == "tag":
-        if len(sys.argv) < 3:
-            print("Provide tag")
-            sys.exit(1)
-        tag = sys.argv[2].lower()
-        for t in tags.get_tags():
-            if tag in t['tag'].lower():
-                movie = movies.get_movie(t['movieId'])
-                if movie:
-                    print(f"{movie['title']}")
+        if len(args) < 2:
+            return ["Provide tag"], 1
+        for movie_id, count in dataset.tags.search_tags(args[1]):
+            movie = dataset.movies.get_movie(movie_id)
+            if movie:
+                out.append(f"{movie['title']} ({count})")
+        
+    elif command == "similar":
+        if len(args) < 2:
+            return ["Provide movie ID or title"], 1
+        key = args[1]
+        k = int(args[2]) if len(args) > 2 else 10
+        movie = dataset.movies.get_movie(key) or dataset.movies.get_movie_by_title(key)
+        if not movie:
+            return ["Movie not found"], 1
+        for movie_id, score in dataset.get_similarity().similar(movie['movieId'], k):
+            similar_movie = dataset.movies.get_movie(movie_id)
+            if similar_movie:
+                out.append(f"{similar_movie['title']} - {score:.3f}")
+        
+    elif command == "window":
+        if len(args) < 3:
+            return ["Provide movie ID or title and a period"], 1
+        movie = dataset.movies.get_movie(args[1]) or dataset.movies.get_movie_by_title(args[1])
+        if not movie:
+            return ["Movie not found"], 1
+        stats = dataset.ratings.get_window_stats(args[2], movie['movieId'])
+        out.append(f"{movie['title']} in {args[2]}: {stats['count']} ratings, "
+                   f"mean: {stats['mean']:.2f}, median: {stats['median']:.2f}")
+        for bucket_start, count, mean in dataset.ratings.get_rating_buckets('month', movie['movieId'], args[2]):
+            out.append(f"{datetime.fromtimestamp(bucket_start, timezone.utc):%Y-%m}: {count} ratings, mean: {mean:.2f}")
+        
+    elif command == "trending":
+        n = int(args[1]) if len(args) > 1 else 10
+        method = args[2] if len(args) > 2 else 'decay'
+        days = int(args[3]) if len(args) > 3 else 30
+        for movie, score in dataset.ratings.trending(n, method, half_life=days * DAY, window=days * DAY):
+            out.append(f"{movie['title']} - {method}: {score:.2f}")
         
     elif command == "imdb":
-        if len(sys.argv) < 3:
-            print("Provide IMDB id or movie title")
-            sys.exit(1)
-        key = sys.argv[2]
-        link = links.get_movie_links(key) or links.get_link_by_title(key)
+        if len(args) < 2:
+            return ["Provide IMDB id or movie title"], 1
+        key = args[1]
+        link = dataset.links.get_movie_links(key) or dataset.links.get_link_by_title(key)
         if link:
-            print(f"IMDB: https://www.imdb.com/title/tt{str(link['imdbId']).zfill(7)}/")
+            out.append(f"IMDB: {IMDB_URL.format(str(link['imdbId']).zfill(7))}")
         else:
-            print("Not found")
+            out.append("Not found")
+        
+    elif command == "export":
+        if len(args) < 2:
+            return ["Provide output path"], 1
+        rows = export_catalog(args[1], dataset.movies, dataset.links, dataset.ratings)
+        out.append(f"Exported {rows} movies to {args[1]}")
         
     elif command == "stats":
-        print(f"Movies: {len(movies.get_movies())}")
-        print(f"Ratings: {len(ratings.get_ratings())}")
-        print(f"Tags: {len(tags.get_tags())}")
-        print(f"Years: {movies.get_year_range()}")
+        out.append(f"Movies: {len(dataset.movies.get_movies())}")
+        out.append(f"Ratings: {len(dataset.ratings)}")
+        out.append(f"Tags: {len(dataset.tags.get_tags())}")
+        out.append(f"Years: {dataset.movies.get_year_range()}")
+        out.extend(_sketch_lines(dataset.get_sketches()))
         
     elif command == "years":
-        min_year, max_year = movies.get_year_range()
-        print(f"Years: {min_year} - {max_year}")
+        min_year, max_year = dataset.movies.get_year_range()
+        out.append(f"Years: {min_year} - {max_year}")
         
     else:
-        print("Unknown command") 
\ No newline at end of file
+        return ["Unknown command"], 1
+    return out, 0
+
+def run_stream_command(directory, args):
+    command = args[0]
+    movies = Movies(os.path.join(directory, 'movies.csv'), cache=True)
+    ratings_path = os.path.join(directory, 'ratings.csv')
+    out = []
+    if command == 'top':
+        aggregator = aggregate_ratings(ratings_path, movies)
+        n = int(args[1]) if len(args) > 1 else 5
+        method = args[2] if len(args) > 2 else 'mean'
+        min_count = int(args[3]) if len(args) > 3 else 1
+        for movie, score in aggregator.top_by_ratings(n, method, min_count=min_count):
+            out.append(f"{movie['title']} - {method}: {score:.2f}")
+    else:
+        sketches = sketch_dataset(ratings_path, os.path.join(directory, 'tags.csv'), movies,
+                                  workers=os.cpu_count() or 1)
+        out.append(f"Movies: {len(movies.get_movies())}")
+        out.append(f"Ratings: {sketches.n_ratings}")
+        out.append(f"Tags: {sketches.n_tags}")
+        out.append(f"Years: {movies.get_year_range()}")
+        out.extend(_sketch_lines(sketches))
+    return out, 0
+
+def _parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 500: 'Internal Server Error'}
+
+async def _handle_client(dataset, reader, writer):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if method == 'POST' and path == '/run':
+                try:
+                    args = [str(arg) for arg in json.loads(body or b'{}').get('args', [])]
+                    if args and args[0] in CLI_ONLY_COMMANDS:
+                        code, payload = 403, {'error': f"{args[0]} is only available from the command line"}
+                    else:
+                        lines, status = await loop.run_in_executor(None, run_command, dataset, args)
+                        code, payload = 200, {'status': status, 'lines': lines}
+                except ValueError as e:
+                    code, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    code, payload = 500, {'error': str(e)}
+            elif method == 'GET' and path == '/health':
+                code, payload = 200, {'status': 0, 'directory': os.path.abspath(dataset.directory)}
+            else:
+                code, payload = 404, {'error': f"Unknown endpoint {method} {path}"}
+            data = json.dumps(payload).encode('utf-8')
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            writer.write((f"HTTP/1.1 {code} {HTTP_REASONS[code]}\r\n"
+                          f"Content-Type: application/json; charset=utf-8\r\n"
+                          f"Content-Length: {len(data)}\r\n"
+                          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + data)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ValueError, EOFError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_server(dataset, address=SERVER_ADDRESS):
+    import asyncio
+    host, port = _parse_address(address)
+    return await asyncio.start_server(lambda r, w: _handle_client(dataset, r, w), host, port)
+
+def serve(dataset, address=SERVER_ADDRESS):
+    import asyncio
+    dataset.load().ratings.get_aggregates()
+    dataset.get_sketches()
+    async def run():
+        server = await start_server(dataset, address)
+        host, port = server.sockets[0].getsockname()[:2]
+        print(f"Serving {dataset.directory} on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+def query_server(args, address=SERVER_ADDRESS, directory=DATASET_DIR, connect_timeout=0.2):
+    import http.client
+    host, port = _parse_address(address)
+    conn = http.client.HTTPConnection(host, port, timeout=connect_timeout)
+    try:
+        conn.request('GET', '/health')
+        health = json.loads(conn.getresponse().read())
+        if health.get('directory') != os.path.abspath(directory):
+            return None
+        conn.sock.settimeout(None)
+        conn.request('POST', '/run', body=json.dumps({'args': list(args)}),
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        payload = json.loads(response.read())
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise Exception(f"Server error: {payload.get('error')}")
+    return payload['lines'], payload['status']
+
+def _run_cli(args, stream, local):
+    command = args[0]
+    if command == 'serve':
+        serve(MovieLensDataset(), args[1] if len(args) > 1 else SERVER_ADDRESS)
+        return [], 0
+    if stream and command in ('top', 'stats'):
+        return run_stream_command(DATASET_DIR, args)
+    response = None if local or command in CLI_ONLY_COMMANDS else query_server(args)
+    if response is None:
+        dataset = MovieLensDataset()
+        start = time.perf_counter()
+        response = run_command(dataset, args)
+        if _profiler is not None:
+            _profiler.observe(f'cli.{command}', time.perf_counter() - start)
+    return response
+
+def main(argv):
+    stream = '--stream' in argv
+    local = '--local' in argv
+    profile = [arg for arg in argv if arg == '--profile' or arg.startswith('--profile=')]
+    args = [arg for arg in argv if arg not in ('--stream', '--local') and arg not in profile]
+    if not args:
+        print('\n'.join(USAGE))
+        return 1
+    if not profile:
+        lines, status = _run_cli(args, stream, local)
+    else:
+        import cProfile
+        stats_path = profile[-1].partition('=')[2]
+        profiler = start_profiling()
+        cprofile = cProfile.Profile() if stats_path else None
+        try:
+            if cprofile is not None:
+                lines, status = cprofile.runcall(_run_cli, args, stream, True)
+            else:
+                lines, status = _run_cli(args, stream, True)
+        finally:
+            stop_profiling()
+        lines = list(lines) + [''] + profiler.summary()
+        if cprofile is not None:
+            cprofile.dump_stats(stats_path)
+            lines.append(f"cProfile stats written to {stats_path}")
+    for line in lines:
+        print(line)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
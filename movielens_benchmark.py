@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import resource
+import platform
+import gzip
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from movielens_analysis import Movies, Ratings, Tags, Links, MovieLensDataset, run_command, _open_text, _physical_path
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary',
+          'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'Musical', 'Mystery', 'Romance',
+          'Sci-Fi', 'Thriller', 'War', 'Western']
+
+def write_synthetic_dataset(directory, n_ratings, n_movies=None, n_users=None, seed=0):
+    n_movies = n_movies or max(n_ratings // 400, 10)
+    n_users = n_users or max(n_ratings // 150, 10)
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'movies.csv'), 'w', encoding='utf-8') as f:
+        f.write('movieId,title,genres\n')
+        for movie_id in range(1, n_movies + 1):
+            genres = '|'.join(rng.sample(GENRES, rng.randint(1, 3)))
+            f.write(f"{movie_id},Movie {movie_id} ({rng.randint(1920, 2020)}),{genres}\n")
+    with open(os.path.join(directory, 'links.csv'), 'w', encoding='utf-8') as f:
+        f.write('movieId,imdbId,tmdbId\n')
+        for movie_id in range(1, n_movies + 1):
+            f.write(f"{movie_id},{str(movie_id * 7).zfill(7)},{movie_id * 3}\n")
+    with open(os.path.join(directory, 'ratings.csv'), 'w', encoding='utf-8') as f:
+        f.write('userId,movieId,rating,timestamp\n')
+        per_user = max(n_ratings // n_users, 1)
+        written = 0
+        for user_id in range(1, n_users + 1):
+            rows = per_user if user_id < n_users else n_ratings - written
+            lines = [f"{user_id},{int(rng.paretovariate(1.2)) % n_movies + 1},{rng.randint(1, 10) / 2},"
+                     f"{rng.randint(789652009, 1574327703)}\n" for _ in range(rows)]
+            f.writelines(lines)
+            written += rows
+    with open(os.path.join(directory, 'tags.csv'), 'w', encoding='utf-8') as f:
+        f.write('userId,movieId,tag,timestamp\n')
+        words = ['pixar', 'funny', 'dark comedy', 'sci-fi', 'atmospheric', 'twist ending', 'classic']
+        for _ in range(max(n_ratings // 25, 1)):
+            f.write(f"{rng.randint(1, n_users)},{rng.randint(1, n_movies)},{rng.choice(words)},"
+                    f"{rng.randint(789652009, 1574327703)}\n")
+    return directory
+
+def bench_workers(directory, worker_counts, repeat):
+    movies = Movies(os.path.join(directory, 'movies.csv'))
+    ratings_path = os.path.join(directory, 'ratings.csv')
+    print(f"{'workers':>8} {'seconds':>10} {'rows/s':>12} {'speedup':>8}")
+    baseline = None
+    for workers in worker_counts:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ratings = Ratings(ratings_path, movies, workers=workers)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        print(f"{workers:>8} {best:>10.3f} {len(ratings) / best:>12.0f} {baseline / best:>8.2f}")
+
+SERVER_COMMANDS = [['years'], ['stats'], ['top', '10'], ['top', '10', 'median'], ['movie', '1'],
+                   ['genre', 'Drama'], ['year', '1995'], ['user', '1'], ['tag', 'fun'], ['imdb', '1']]
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_for_server(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+def _client(port, requests):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    for i in range(requests):
+        body = json.dumps({'args': SERVER_COMMANDS[i % len(SERVER_COMMANDS)]})
+        start = time.perf_counter()
+        conn.request('POST', '/run', body=body, headers={'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+def bench_server(directory, client_counts, requests):
+    port = _free_port()
+    env = dict(os.environ, MOVIELENS_DATA=directory)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'movielens_analysis.py')
+    server = subprocess.Popen([sys.executable, script, 'serve', f'127.0.0.1:{port}'], env=env,
+                              stdout=subprocess.DEVNULL)
+    try:
+        _wait_for_server(port)
+        print(f"{'clients':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+        for clients in client_counts:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(_client, [port] * clients, [requests] * clients))
+            elapsed = time.perf_counter() - start
+            latencies = sorted(latency for result in results for latency in result)
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            print(f"{clients:>8} {len(latencies) / elapsed:>10.0f} {p50:>10.2f} {p99:>10.2f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+SUITE_COMMANDS = SERVER_COMMANDS + [['window', '1', '2010'], ['trending', '10'], ['trending', '10', 'delta']]
+
+SCALE_SUFFIXES = {'K': 1000, 'M': 1000000}
+
+def _parse_scale(text):
+    text = text.strip().upper()
+    if text[-1:] in SCALE_SUFFIXES:
+        return int(float(text[:-1]) * SCALE_SUFFIXES[text[-1]])
+    return int(text)
+
+def _best_of(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def _per_call(fn, keys, repeat):
+    best, _ = _best_of(lambda: [fn(key) for key in keys], repeat)
+    return best / len(keys)
+
+def measure(directory, repeat=3):
+    path = lambda name: os.path.join(directory, name)
+    timings = {}
+    timings['Movies()'], movies = _best_of(lambda: Movies(path('movies.csv')), repeat)
+    timings['Ratings()'], ratings = _best_of(lambda: Ratings(path('ratings.csv'), movies), repeat)
+    timings['Tags()'], _ = _best_of(lambda: Tags(path('tags.csv'), movies), repeat)
+    timings['Links()'], _ = _best_of(lambda: Links(path('links.csv'), movies), repeat)
+    sample = random.Random(0).sample(movies.get_movies(), min(1000, len(movies.get_movies())))
+    timings['get_movie'] = _per_call(movies.get_movie, [m['movieId'] for m in sample], repeat)
+    timings['get_movie_by_title'] = _per_call(movies.get_movie_by_title, [m['title'] for m in sample], repeat)
+    for method in ('mean', 'median'):
+        start = time.perf_counter()
+        ratings.top_by_ratings(10, method)
+        timings[f'top_by_ratings[{method}] cold'] = time.perf_counter() - start
+        def top():
+            ratings.query_cache.clear()
+            return ratings.top_by_ratings(10, method)
+        timings[f'top_by_ratings[{method}]'], _ = _best_of(top, repeat)
+    timings['MovieLensDataset()'], dataset = _best_of(lambda: MovieLensDataset(directory, cache=False), 1)
+    for args in SUITE_COMMANDS:
+        def command():
+            dataset.movies.query_cache.clear()
+            dataset.ratings.query_cache.clear()
+            return run_command(dataset, args)
+        name = ' '.join(['cli'] + args)
+        timings[f'{name} cold'], _ = _best_of(command, 1)
+        timings[name], _ = _best_of(command, repeat)
+    return {'ratings': len(ratings), 'timings': timings,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def run_suite(scales, data, repeat, output):
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        targets = [(None, data)] if data else [(scale, None) for scale in scales]
+        for scale, directory in targets:
+            if directory is None:
+                directory = write_synthetic_dataset(os.path.join(tmp, str(scale)), scale)
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', '--data', directory,
+                                     '--repeat', str(repeat)], stdout=subprocess.PIPE, check=True, text=True)
+            run = json.loads(result.stdout)
+            run['scale'] = scale or run['ratings']
+            runs.append(run)
+            print(f"{run['scale']:>10} ratings: Ratings() {run['timings']['Ratings()']:.3f}s, "
+                  f"peak RSS {run['peak_rss_kb'] / 1024:.0f} MB")
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs': runs}
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return report
+
+def compare_reports(base, new, threshold=0.2, min_delta=0.001, cold_threshold=1.0, cold_min_delta=0.05):
+    base_runs = {run['scale']: run for run in base['runs']}
+    regressions = []
+    print(f"{'scale':>10} {'metric':<40} {'base':>10} {'new':>10} {'change':>8}")
+    for run in new['runs']:
+        old = base_runs.get(run['scale'])
+        if old is None:
+            continue
+        metrics = []
+        for name, value in run['timings'].items():
+            if name in old['timings']:
+                cold = name.endswith(' cold')
+                metrics.append((name, old['timings'][name], value, cold_threshold if cold else threshold,
+                                cold_min_delta if cold else min_delta))
+        metrics.append(('peak_rss_kb', old['peak_rss_kb'], run['peak_rss_kb'], threshold, 1024))
+        for name, before, after, limit, noise in metrics:
+            change = (after - before) / before if before else 0.0
+            regressed = change > limit and after - before > noise
+            print(f"{run['scale']:>10} {name:<40} {before:>10.4g} {after:>10.4g} {change:>+8.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append((run['scale'], name, before, after))
+    return regressions
+
+def _compress(source, directory, codec):
+    name = os.path.basename(source)
+    if codec == 'plain':
+        return source
+    if codec == 'gzip':
+        target = os.path.join(directory, name + '.gz')
+        with open(source, 'rb') as src, gzip.open(target, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        return target
+    if codec == 'zip':
+        archive = os.path.join(directory, 'ratings.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(source, 'ml-bench/' + name)
+        return f"{archive}/ml-bench/{name}"
+    if codec == 'zstd':
+        import zstandard
+        target = os.path.join(directory, name + '.zst')
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+        return target
+    raise ValueError(f"Unknown codec: {codec}")
+
+def bench_codecs(directory, codecs, repeat):
+    movies = Movies(os.path.join(directory, 'movies.csv'))
+    source = os.path.join(directory, 'ratings.csv')
+    size = os.path.getsize(source)
+    print(f"{'codec':>8} {'MB':>8} {'ratio':>6} {'read MB/s':>10} {'load s':>8} {'rows/s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for codec in codecs:
+            try:
+                path = _compress(source, tmp, codec)
+            except ImportError as e:
+                print(f"{codec:>8} skipped: {e}")
+                continue
+            stored = os.path.getsize(_physical_path(path))
+            def read():
+                with _open_text(path) as f:
+                    for _ in iter(lambda: f.read(1 << 20), ''):
+                        pass
+            read_time, _ = _best_of(read, repeat)
+            load_time, ratings = _best_of(lambda: Ratings(path, movies), repeat)
+            print(f"{codec:>8} {stored / 1e6:>8.1f} {size / stored:>6.2f} {size / read_time / 1e6:>10.1f} "
+                  f"{load_time:>8.3f} {len(ratings) / load_time:>10.0f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MovieLens loader benchmarks')
+    parser.add_argument('command', choices=['workers', 'server', 'suite', 'measure', 'compare', 'codecs'])
+    parser.add_argument('reports', nargs='*', help='base and new result files for compare')
+    parser.add_argument('--data', help='directory with MovieLens CSVs (synthetic data is generated if omitted)')
+    parser.add_argument('--ratings', type=int, default=1000000, help='synthetic ratings count')
+    parser.add_argument('--workers', default='1,2,4,8,16', help='comma-separated worker counts')
+    parser.add_argument('--repeat', type=int, default=3, help='best-of-N repetitions for each timing')
+    parser.add_argument('--clients', default='1,4,16', help='comma-separated concurrent client counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--scales', default='100K,1M', help='comma-separated synthetic sizes for suite, e.g. 100K,1M,10M,25M')
+    parser.add_argument('--output', default='benchmark.json', help='suite result file')
+    parser.add_argument('--codecs', default='plain,gzip,zip,zstd', help='comma-separated codecs for codecs')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown reported as a regression')
+    parser.add_argument('--cold-threshold', type=float, default=1.0,
+                        help='relative slowdown reported as a regression for single-shot cold timings')
+    args = parser.parse_args(argv)
+    if args.command == 'measure':
+        print(json.dumps(measure(args.data, args.repeat)))
+        return 0
+    if args.command == 'suite':
+        run_suite([_parse_scale(scale) for scale in args.scales.split(',')], args.data, args.repeat, args.output)
+        return 0
+    if args.command == 'compare':
+        if len(args.reports) != 2:
+            parser.error('compare needs a base and a new result file')
+        reports = []
+        for name in args.reports:
+            with open(name, encoding='utf-8') as f:
+                reports.append(json.load(f))
+        regressions = compare_reports(reports[0], reports[1], args.threshold, cold_threshold=args.cold_threshold)
+        print(f"{len(regressions)} regression(s)")
+        return 1 if regressions else 0
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.data or write_synthetic_dataset(tmp, args.ratings)
+        if args.command == 'workers':
+            bench_workers(directory, [int(w) for w in args.workers.split(',')], args.repeat)
+        elif args.command == 'server':
+            bench_server(directory, [int(c) for c in args.clients.split(',')], args.requests)
+        elif args.command == 'codecs':
+            bench_codecs(directory, args.codecs.split(','), args.repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
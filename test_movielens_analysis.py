@@ -0,0 +1,701 @@
+import os
+import io
+import csv
+import time
+import socket
+import asyncio
+from array import array
+from collections import Counter
+
+import pytest
+
+from movielens_analysis import *
+from movielens_analysis import _byte_ranges, _utc
+
+TEST_MOVIES_DATA = """movieId,title,genres
+1,Toy Story (1995),Adventure|Animation|Children|Comedy|Fantasy
+2,Jumanji (1995),Adventure|Children|Fantasy
+3,Grumpier Old Men (1995),Comedy|Romance"""
+
+TEST_RATINGS_DATA = """userId,movieId,rating,timestamp
+1,1,4.5,1147880044
+1,2,3.0,1147880044
+2,1,5.0,1147880044"""
+
+TEST_TAGS_DATA = """userId,movieId,tag,timestamp
+1,1,pixar,1147880044
+2,1,animation,1147880044
+3,2,fantasy,1147880044"""
+
+TEST_LINKS_DATA = """movieId,imdbId,tmdbId
+1,114709,862
+2,113497,8844
+3,113228,15602"""
+
+@pytest.fixture
+def setup_classes():
+    test_files = {
+        'test_movies.csv': TEST_MOVIES_DATA,
+        'test_ratings.csv': TEST_RATINGS_DATA,
+        'test_tags.csv': TEST_TAGS_DATA,
+        'test_links.csv': TEST_LINKS_DATA
+    }
+    
+    try:
+        for filename, content in test_files.items():
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write(content)
+        
+        movies = Movies('test_movies.csv')
+        ratings = Ratings('test_ratings.csv', movies)
+        tags = Tags('test_tags.csv', movies)
+        links = Links('test_links.csv', movies)
+        
+        yield movies, ratings, tags, links
+    finally:
+        for filename in test_files:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+def test_movies_types(setup_classes):
+    movies, _, _, _ = setup_classes
+    
+    movies_list = movies.get_movies()
+    assert isinstance(movies_list, list)
+    assert all(isinstance(movie, Movie) for movie in movies_list)
+    assert len(movies_list) == 3
+    
+    movie = movies.get_movie(1)
+    assert isinstance(movie, Movie)
+    assert movie['title'] == 'Toy Story (1995)'
+    assert movie.genres == ('Adventure', 'Animation', 'Children', 'Comedy', 'Fantasy')
+    assert movie.genre_mask == movies.genre_mask(movie.genres)
+    assert movie.year == 1995
+    
+    genres = movies.get_genres()
+    assert isinstance(genres, list)
+    assert all(isinstance(genre, str) for genre in genres)
+    assert genres == sorted(genres)
+    assert 'Adventure' in genres
+
+def test_movies_indexes(setup_classes):
+    movies, _, _, _ = setup_classes
+    
+    assert movies.get_movie('2')['title'] == 'Jumanji (1995)'
+    assert movies.get_movie_by_title('JUMANJI (1995)') is movies.get_movie(2)
+    assert [m['movieId'] for m in movies.get_movies_by_year(1995)] == [1, 2, 3]
+    assert [m['movieId'] for m in movies.get_movies_by_genre('Fantasy')] == [1, 2]
+    assert movies.get_movies_by_genre('Fi') == []
+
+def test_ratings_types(setup_classes):
+    _, ratings, _, _ = setup_classes
+    
+    ratings_list = ratings.get_ratings()
+    assert isinstance(ratings_list, list)
+    assert all(isinstance(rating, dict) for rating in ratings_list)
+    assert len(ratings_list) == 3
+    
+    movie_ratings = ratings.get_movie_ratings(1)
+    assert isinstance(movie_ratings, list)
+    assert len(movie_ratings) == 2
+    
+    avg_rating = ratings.get_average_rating(1)
+    assert isinstance(avg_rating, float)
+    assert avg_rating == 4.75
+
+def test_ratings_columns(setup_classes):
+    _, ratings, _, _ = setup_classes
+    
+    assert len(ratings) == 3
+    assert list(ratings.movie_keys) == [1, 2]
+    assert list(ratings.movie_offsets) == [0, 2, 3]
+    values = ratings.get_movie_rating_values('1')
+    assert isinstance(values, memoryview)
+    assert values.obj is ratings.values
+    assert sorted(values) == [4.5, 5.0]
+    assert list(ratings.get_title_rating_values('Jumanji (1995)')) == [3.0]
+    assert ratings.get_median_rating(1) == 4.75
+    assert ratings.get_ratings_by_title('jumanji (1995)')[0]['userId'] == 1
+    assert ratings.get_movie_rating_values('invalid').tolist() == []
+    
+    unsorted = Ratings(io.StringIO('userId,movieId,rating,timestamp\n'
+                                   '1,1,5.0,1147880044\n2,1,3.0,1147880045\n3,1,4.0,1147880046\n4,1,1.0,1147880047\n'),
+                       ratings.movies_obj)
+    assert [r['userId'] for r in unsorted.get_movie_ratings(1)] == [1, 2, 3, 4]
+    assert unsorted.get_movie_rating_values(1).tolist() == [5.0, 3.0, 4.0, 1.0]
+    assert unsorted.get_median_rating(1) == 3.5 and list(unsorted.get_aggregates()['median']) == [3.5]
+
+def test_top_by_ratings(setup_classes):
+    _, ratings, _, _ = setup_classes
+    
+    aggregates = ratings.get_aggregates()
+    assert list(aggregates['count']) == [2, 1]
+    assert list(aggregates['median']) == [4.75, 3.0]
+    assert list(aggregates['variance']) == [0.0625, 0.0]
+    
+    top = ratings.top_by_ratings(1, 'median')
+    assert [(m['movieId'], score) for m, score in top] == [(1, 4.75)]
+    assert [m['movieId'] for m, _ in ratings.top_by_ratings(5, 'mean')] == [1, 2]
+    assert [m['movieId'] for m, _ in ratings.top_by_ratings(5, min_count=2)] == [1]
+    assert [m['movieId'] for m, _ in ratings.top_by_ratings(5, genres=['Children', 'Fantasy'])] == [1, 2]
+    assert ratings.top_by_ratings(5, genres='Romance') == []
+    assert ratings.top_by_ratings(5, years=(1990, 1999), genres='Animation')[0][0]['movieId'] == 1
+    
+    bayesian = dict((m['movieId'], score) for m, score in ratings.top_by_ratings(5, 'bayesian', prior=1))
+    global_mean = 12.5 / 3
+    assert bayesian[1] == (2 * 4.75 + global_mean) / 3
+    assert ratings.top_by_ratings(5, 'unknown') == []
+
+def test_faceted_filtering(setup_classes):
+    movies, ratings, _, _ = setup_classes
+    ids = lambda found: [m['movieId'] for m in found]
+
+    assert movies.count_movies('Adventure') == 2
+    assert ids(movies.filter_movies(['Comedy', 'Romance'])) == [3]
+    assert movies.filter_movies('Fi') == []
+    assert ids(movies.filter_movies(years='1990-1999')) == [1, 2, 3]
+    assert movies.filter_movies(years=(1996, 2000)) == [] and movies.filter_movies(decades=1980) == []
+    assert ids(movies.filter_movies('Children', 1995, [1990])) == [1, 2]
+
+    assert [(m['movieId'], score) for m, score in ratings.filter_movies('Fantasy', min_rating=4)] == [(1, 4.75)]
+    assert [(m['movieId'], score) for m, score in ratings.filter_movies(min_count=1, sort='count')] == [(1, 2), (2, 1)]
+    assert ids(m for m, _ in ratings.filter_movies(decades=1990, min_count=2)) == [1]
+    assert [(m['movieId'], score) for m, score in ratings.filter_movies('Romance', sort='mean')] == [(3, 0.0)]
+
+    movies._add_movie(4, 'Heat (1995)', 'Action|Crime|Thriller')
+    assert movies.count_movies(decades=1990) == 4 and ids(movies.filter_movies('Crime')) == [4]
+    ratings.append([(1, 4, 4.0, 1147880044)])
+    assert ids(m for m, _ in ratings.filter_movies(min_rating=4)) == [1, 4]
+
+def test_incremental_ingestion(setup_classes, tmp_path):
+    movies, ratings, tags, _ = setup_classes
+
+    assert ratings.get_median_rating(2) == 3.0
+    assert ratings.append([(3, 2, 5.0, 1147880045), {'userId': 3, 'movieId': 3, 'rating': 2.0, 'timestamp': 1147880046}]) == 2
+    assert len(ratings) == 5 and len(ratings.values) == 3
+    assert ratings.get_median_rating(2) == 4.0
+    assert ratings.get_average_rating(3) == 2.0
+    assert [r['rating'] for r in ratings.get_movie_ratings(2)] == [3.0, 5.0]
+    top = ratings.top_by_ratings(5, 'mean')
+    assert [(m['movieId'], score) for m, score in top] == [(1, 4.75), (2, 4.0), (3, 2.0)]
+    assert [m['movieId'] for m, _ in ratings.top_by_ratings(5, genres='Romance')] == [3]
+
+    delta = tmp_path / 'delta.csv'
+    delta.write_text("userId,movieId,rating,timestamp\n4,3,4.0,1147880047\n")
+    assert ratings.ingest_delta(str(delta)) == 1
+    assert ratings.get_median_rating(3) == 3.0
+    overlay = {name: list(column) for name, column in ratings.get_aggregates().items()}
+    profile = ratings.get_user_profile(3)
+    assert (profile['count'], profile['mean'], profile['last_timestamp']) == (2, 3.5, 1147880046)
+    assert [r['movieId'] for r in ratings.get_user_ratings(3)] == [2, 3]
+    assert ratings.get_user_profile(4)['favourite_genres'][0] == ('Comedy', 1)
+    assert ratings.get_window_stats(2006, 3) == {'start': _utc(2006), 'end': _utc(2007),
+                                                 'count': 2, 'mean': 3.0, 'median': 3.0}
+    assert len(ratings.get_ratings()) == 6
+    assert len(ratings.delta[2]) == 3 and len(ratings.values) == 3
+    ratings.compact()
+    assert not ratings.delta[2] and len(ratings.values) == 6
+    assert {name: list(column) for name, column in ratings.get_aggregates().items()} == overlay
+    assert ratings.get_user_profile(3) == profile
+
+    follow = ratings.tail(str(delta), poll_interval=0)
+    assert next(follow) == (0, delta.stat().st_size)
+    with open(delta, 'a') as f:
+        f.write("5,1,1.0,1147880048\n5,2,2.")
+    added, offset = next(follow)
+    assert added == 1 and ratings.get_movie_rating_values(1).tolist() == [4.5, 5.0, 1.0]
+    assert ratings.get_median_rating(1) == 4.5
+    with open(delta, 'a') as f:
+        f.write("5,1147880049\n")
+    assert next(follow) == (1, delta.stat().st_size)
+
+    assert tags.append([(4, 2, 'board game', 1147880050)]) == 1
+    assert [t.tag for t in tags.get_tags_by_title('Jumanji (1995)')] == ['fantasy', 'board game']
+    assert tags.search_tags('board') == [(2, 1)]
+
+def test_time_windows(setup_classes):
+    _, ratings, tags, _ = setup_classes
+    ratings.append([(3, 1, 1.0, _utc(2015, 3, 1)), (4, 1, 3.0, _utc(2015, 7, 10)),
+                    (4, 2, 4.0, _utc(2015, 7, 20)), (5, 2, 5.0, _utc(2015, 7, 25))])
+
+    assert ratings.get_window_stats(2015, 1) == {'start': _utc(2015), 'end': _utc(2016),
+                                                 'count': 2, 'mean': 2.0, 'median': 2.0}
+    assert ratings.get_window_stats('2015-07', 1)['mean'] == 3.0
+    assert ratings.get_window_stats(('2015-07-15', '2016'))['count'] == 2
+    assert ratings.get_window_stats(2015)['mean'] == 3.25
+    assert ratings.get_window_stats(2020, 1)['count'] == 0
+
+    assert ratings.get_rating_buckets('month', 1) == [(_utc(2006, 5), 2, 4.75), (_utc(2015, 3), 1, 1.0),
+                                                      (_utc(2015, 7), 1, 3.0)]
+    assert ratings.get_rating_buckets('week', period=2015) == [(_utc(2015, 2, 23), 1, 1.0), (_utc(2015, 7, 6), 1, 3.0),
+                                                               (_utc(2015, 7, 20), 2, 4.5)]
+    assert len(ratings.get_rating_buckets('day', 2)) == 3
+    with pytest.raises(ValueError):
+        ratings.get_rating_buckets('year')
+
+    delta = ratings.trending(5, 'delta', now=_utc(2015, 8, 1), window=30 * DAY)
+    assert [(m['movieId'], score) for m, score in delta] == [(2, 2), (1, 1)]
+    now = _utc(2015, 7, 25) + 1
+    decay = dict((m['movieId'], score) for m, score in ratings.trending(5, half_life=10 * DAY))
+    expected = sum(2 ** ((t - now) / (10 * DAY)) for t in (_utc(2015, 7, 20), _utc(2015, 7, 25)))
+    assert decay[2] == pytest.approx(expected)
+    assert decay[2] > decay[1]
+    assert ratings.trending(3, now=_utc(2000), half_life=7 * DAY) == []
+    historical = ratings.trending(3, now=_utc(2015, 3, 2), half_life=3600)
+    assert [(m['movieId'], score) for m, score in historical] == [(1, 2.0 ** -24), (2, 0.0)]
+
+    assert len(tags.get_tags_between(2006)) == 3 and tags.get_tags_between('2007-01') == []
+    assert tags.trending_tags(2) == [('pixar', 1), ('animation', 1)]
+    assert tags.trending_tags(5, window=DAY, now=_utc(2006, 5, 19)) == []
+
+def test_tags_types(setup_classes):
+    _, _, tags, _ = setup_classes
+    
+    tags_list = tags.get_tags()
+    assert isinstance(tags_list, list)
+    assert all(isinstance(tag, Tag) for tag in tags_list)
+    assert len(tags_list) == 3
+    
+    movie_tags = tags.get_movie_tags(1)
+    assert isinstance(movie_tags, list)
+    assert len(movie_tags) == 2
+    
+    common_tags = tags.get_tags_by_title('toy story (1995)')
+    assert isinstance(common_tags, list)
+    assert all(isinstance(tag, Tag) for tag in common_tags)
+    assert all(isinstance(tag['tag'], str) for tag in common_tags)
+
+def test_links_types(setup_classes):
+    _, _, _, links = setup_classes
+    
+    links_list = links.get_links()
+    assert isinstance(links_list, list)
+    assert all(isinstance(link, Link) for link in links_list)
+    assert len(links_list) == 3
+    
+    movie_links = links.get_movie_links(1)
+    assert isinstance(movie_links, Link)
+    assert movie_links.movieId == 1
+    assert movie_links['imdbId'] == '114709'
+    
+    imdb_link = links.get_imdb_link(1)
+    assert isinstance(imdb_link, str)
+    assert imdb_link == 'https://www.imdb.com/title/tt0114709/'
+
+def test_links_batch_and_export(setup_classes, tmp_path):
+    movies, ratings, _, links = setup_classes
+
+    batch = links.get_links_batch([1, '2', 4, 'x'])
+    assert batch['imdbId'] == ['114709', '113497', None, None]
+    assert batch['imdb_url'] == [links.get_imdb_link(1), links.get_imdb_link(2), '', '']
+    assert batch['tmdb_url'][1] == 'https://www.themoviedb.org/movie/8844'
+    assert links.get_links_by_titles(['JUMANJI (1995)', 'Heat'])['tmdbId'] == ['8844', None]
+    assert ratings.get_aggregates_batch([2, 3]) == {'rating_count': [1, 0], 'rating_mean': [3.0, None],
+                                                    'rating_median': [3.0, None]}
+
+    path = tmp_path / 'catalog.csv'
+    assert export_catalog(str(path), movies, links, ratings, chunk_size=2) == 3
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['movieId'] for row in rows] == ['1', '2', '3']
+    assert rows[0]['imdb_url'] == 'https://www.imdb.com/title/tt0114709/' and rows[0]['rating_mean'] == '4.75'
+    assert rows[2]['tmdbId'] == '15602' and rows[2]['rating_count'] == '0' and rows[2]['rating_mean'] == ''
+    assert export_catalog(str(tmp_path / 'plain.csv'), movies, links) == 3
+    with pytest.raises(ValueError):
+        export_catalog(str(tmp_path / 'catalog.xlsx'), movies, links, format='xlsx')
+    try:
+        import pyarrow
+    except ImportError:
+        with pytest.raises(Exception, match='pyarrow'):
+            export_catalog(str(tmp_path / 'catalog.parquet'), movies, links, ratings)
+
+def test_user_profiles(setup_classes):
+    _, ratings, _, _ = setup_classes
+    
+    assert [r['movieId'] for r in ratings.get_user_ratings(1)] == [1, 2]
+    assert ratings.get_user_ratings('invalid') == []
+    profile = ratings.get_user_profile('1')
+    assert profile['count'] == 2
+    assert profile['mean'] == 3.75
+    assert profile['histogram'][6] == 1 and profile['histogram'][9] == 1
+    assert profile['favourite_genres'][:2] == [('Adventure', 2), ('Children', 2)]
+    assert profile['first_timestamp'] == profile['last_timestamp'] == 1147880044
+    
+    profiles = ratings.get_user_profiles([1, 2, 99])
+    assert profiles[2]['mean'] == 5.0
+    assert profiles[99] is None
+
+def test_query_cache(setup_classes):
+    movies, ratings, _, _ = setup_classes
+    
+    ratings.query_cache = QueryCache(maxsize=2)
+    top = ratings.top_by_ratings(2, genres=['Fantasy'])
+    top.clear()
+    assert ratings.top_by_ratings(2, genres=['Fantasy']) == [(movies.get_movie(1), 4.75), (movies.get_movie(2), 3.0)]
+    ratings.get_average_rating(1)
+    ratings.get_average_rating(2)
+    assert ratings.query_cache.stats()['hits'] == 1
+    assert ratings.query_cache.stats()['evictions'] == 1
+    assert ratings.query_cache.stats()['misses'] == 3
+    ratings.top_by_ratings(2, genres=['Fantasy'])
+    assert ratings.query_cache.stats()['misses'] == 4
+    
+    movies.get_genres().append('Western')
+    assert movies.get_genres() == sorted(movies.genre_to_movies)
+    profile = ratings.get_user_profile(1)
+    profile['histogram'][0] = 99
+    assert ratings.get_user_profile(1)['histogram'][0] == 0
+    version = movies.version
+    movies._add_movie(4, 'Heat (1995)', 'Action|Crime|Thriller')
+    assert movies.version == version + 1
+    assert 'Crime' in movies.get_genres()
+    
+    ratings._build_columns(array('i', [1]), array('i', [4]), array('d', [2.0]), array('q', [0]))
+    assert ratings.get_average_rating(1) == 0.0
+    assert ratings.top_by_ratings(2) == [(movies.get_movie(4), 2.0)]
+    
+    now = [0.0]
+    cache = QueryCache(ttl=10, clock=lambda: now[0])
+    assert cache.lookup('key', 1, lambda: 'a') == 'a'
+    assert cache.lookup('key', 1, lambda: 'b') == 'a'
+    now[0] = 11.0
+    assert cache.lookup('key', 1, lambda: 'c') == 'c'
+    assert cache.lookup('key', 2, lambda: 'd') == 'd'
+
+def test_item_similarity(setup_classes, tmp_path):
+    _, ratings, _, _ = setup_classes
+    
+    similarity = ItemSimilarity.build(ratings, k=5, min_support=1)
+    [(movie_id, score)] = similarity.similar(1)
+    assert movie_id == 2
+    assert score == pytest.approx(4.5 * 3.0 / ((4.5 ** 2 + 5.0 ** 2) ** 0.5 * 3.0))
+    assert similarity.similar(2, k=1)[0][0] == 1
+    assert similarity.similar('invalid') == []
+    assert ItemSimilarity.build(ratings, min_support=2).similar(1) == []
+    
+    adjusted = ItemSimilarity.build(ratings, method='adjusted_cosine', min_support=1)
+    assert adjusted.similar(1)[0][1] == pytest.approx(-1.0)
+    
+    path = str(tmp_path / 'ratings.csv.similarity')
+    assert similarity.save(path)
+    loaded = ItemSimilarity.load(path)
+    assert loaded.similar(1) == similarity.similar(1)
+    assert ItemSimilarity.load(path, source={'size': 0}) is None
+
+def test_streaming_aggregation(setup_classes):
+    movies, ratings, _, _ = setup_classes
+    
+    chunks = list(iter_rating_chunks('test_ratings.csv', chunk_size=2))
+    assert [len(chunk[2]) for chunk in chunks] == [2, 1]
+    assert chunks[0][1].tolist() == [1, 2]
+    assert len(list(iter_rating_chunks('test_ratings.csv', max_memory=RATING_ROW_BYTES))) == 3
+    
+    aggregator = aggregate_ratings('test_ratings.csv', movies, chunk_size=1)
+    assert len(aggregator) == 3
+    assert aggregator.get_average_rating(1) == ratings.get_average_rating(1)
+    assert aggregator.get_median_rating(1) == ratings.get_median_rating(1)
+    assert aggregator.get_histogram(2)[6] == 1
+    assert aggregator.top_by_ratings(2, 'median') == ratings.top_by_ratings(2, 'median')
+    
+    merged = RatingAggregator().merge(aggregator).merge(aggregator)
+    assert merged.get_count(1) == 4
+    assert merged.get_median_rating('invalid') == 0.0
+    
+    tag_chunks = list(iter_tag_chunks('test_tags.csv'))
+    assert tag_chunks[0][2] == ['pixar', 'animation', 'fantasy']
+
+def test_sketches(setup_classes, tmp_path):
+    movies, ratings, tags, _ = setup_classes
+    
+    hll, other = HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        (hll if i % 2 else other).add(i)
+    assert abs(hll.merge(other).count() - 20000) < 20000 * 0.03
+    assert hll.merge(HyperLogLog()).count() == len(hll)
+    with pytest.raises(ValueError):
+        hll.merge(HyperLogLog(10))
+    
+    quantiles, other = QuantileSketch(), QuantileSketch()
+    for i in range(1, 1001):
+        (quantiles if i % 3 else other).add(i / 100)
+    quantiles.merge(other)
+    assert quantiles.quantile(0.5) == pytest.approx(5.0, rel=0.02)
+    assert quantiles.quantile(0) == 0.01 and quantiles.quantile(1) == 10.0
+    
+    cms = CountMinSketch(width=64, depth=3, top=2)
+    for tag, count in [('a', 50), ('b', 30), ('c', 1), ('d', 2)]:
+        cms.add(tag, count)
+    assert [tag for tag, _ in cms.heavy_hitters()] == ['a', 'b']
+    assert cms.estimate('a') >= 50
+    
+    sketches = DatasetSketches(movies).add_ratings(ratings).add_tags(tags)
+    assert sketches.n_ratings == 3 and sketches.n_tags == 3
+    assert sketches.get_distinct_users() == 2
+    assert sketches.get_distinct_users(1) == 2 and sketches.get_distinct_users('x') == 0
+    assert sketches.get_distinct_users(genre='Fantasy') == 2
+    assert sketches.get_distinct_tags(genre='Adventure') == 3
+    assert sketches.get_rating_quantiles((0, 1)) == [(0, 3.0), (1, 5.0)]
+    assert sketches.get_rating_quantiles(genre='Horror')[0][1] is None
+    assert sketches.get_top_tags(1)[0][1] == 1
+    
+    (tmp_path / 'ratings.csv').write_text(TEST_RATINGS_DATA)
+    (tmp_path / 'tags.csv').write_text(TEST_TAGS_DATA)
+    streamed = sketch_dataset(str(tmp_path / 'ratings.csv'), str(tmp_path / 'tags.csv'), movies, chunk_size=1)
+    assert streamed.get_genre_summary() == sketches.get_genre_summary()
+    parallel = sketch_dataset(str(tmp_path / 'ratings.csv'), movies_obj=movies, chunk_size=1, workers=2)
+    assert parallel.get_rating_quantiles() == sketches.get_rating_quantiles()
+    assert parallel.get_distinct_users(genre='Comedy') == 2
+    
+    assert sketches.save(str(tmp_path / 'ratings.sketches'), {'n': 1})
+    assert DatasetSketches.load(str(tmp_path / 'ratings.sketches'), {'n': 2}) is None
+    loaded = DatasetSketches.load(str(tmp_path / 'ratings.sketches'), {'n': 1})
+    assert loaded.get_genre_summary() == sketches.get_genre_summary()
+    assert loaded.get_top_tags() == sketches.get_top_tags()
+    assert loaded.merge(streamed).n_ratings == 6 and loaded.get_distinct_users(1) == 2
+    assert loaded.merge(streamed).get_rating_quantiles((1,)) == [(1, 5.0)] and len(streamed.genre_quantiles['Comedy']) == 2
+
+def test_parallel_parsing(setup_classes, tmp_path):
+    movies, ratings, tags, _ = setup_classes
+    
+    ranges = _byte_ranges('test_ratings.csv', 8)
+    assert ranges[0][1] == len('userId,movieId,rating,timestamp\n')
+    assert ranges[-1][2] == os.path.getsize('test_ratings.csv')
+    assert all(a[2] == b[1] for a, b in zip(ranges, ranges[1:]))
+    
+    parallel = Ratings('test_ratings.csv', movies, workers=2)
+    assert parallel.get_ratings() == ratings.get_ratings()
+    assert Tags('test_tags.csv', movies, workers=2).get_tags() == tags.get_tags()
+    
+    multiline = tmp_path / 'tags.csv'
+    multiline.write_text('userId,movieId,tag,timestamp\n' +
+                         ''.join(f'{i},1,"line one\nline two {i}",{1147880044 + i}\n' for i in range(40)))
+    sequential = Tags(str(multiline), movies, cache=False)
+    parallel_tags = Tags(str(multiline), movies, cache=False, workers=2)
+    assert len(parallel_tags.get_tags()) == 40 and not parallel_tags.rejected
+    assert parallel_tags.get_tags() == sequential.get_tags()
+    
+    follow = Tags(io.StringIO('userId,movieId,tag,timestamp\n'), movies).tail(str(multiline), poll_interval=0)
+    assert next(follow) == (0, multiline.stat().st_size)
+    with open(multiline, 'a') as f:
+        f.write('41,1,"split\nacross')
+    assert next(follow) == (0, multiline.stat().st_size - len('41,1,"split\nacross'))
+    with open(multiline, 'a') as f:
+        f.write(' polls",1147880090\n')
+    assert next(follow) == (1, multiline.stat().st_size)
+
+def test_quoted_csv_fields():
+    movies = Movies(io.StringIO('movieId,title,genres\n'
+                                '11,"American President, The (1995)",Comedy|Drama|Romance\n'
+                                '12,"Dracula: Dead and ""Loving"" It (1995)",Comedy|Horror\n'
+                                'x,Broken (2000),Drama\n'
+                                '13,Missing Genres (2001)\n'
+                                '14,"Unterminated (2002),Drama\n'))
+    assert movies.get_movie(11)['title'] == 'American President, The (1995)'
+    assert movies.get_movie(11)['year'] == 1995
+    assert movies.get_movie(12)['title'] == 'Dracula: Dead and "Loving" It (1995)'
+    assert movies.rejected == Counter({'invalid movieId': 1, 'wrong field count': 1, 'malformed quoting': 1})
+
+    tags = Tags(io.StringIO('userId,movieId,tag,timestamp\n'
+                            '1,11,"politics, romance",1147880044\n'
+                            '2,11,"said ""hi"" twice",1147880045\n'
+                            '3,11,bad,time\n'), movies)
+    assert [t['tag'] for t in tags.get_movie_tags(11)] == ['politics, romance', 'said "hi" twice']
+    assert tags.rejected == Counter({'invalid number': 1})
+
+def test_compressed_inputs(dataset_dir, tmp_path):
+    import gzip
+    import zipfile
+    plain = MovieLensDataset(dataset_dir, cache=False)
+    gz_dir = tmp_path / 'gz'
+    gz_dir.mkdir()
+    archive = tmp_path / 'ml-test.zip'
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name in ('movies.csv', 'ratings.csv', 'tags.csv', 'links.csv'):
+            with open(os.path.join(dataset_dir, name), 'rb') as f:
+                data = f.read()
+            with gzip.open(gz_dir / (name + '.gz'), 'wb') as f:
+                f.write(data)
+            zf.writestr('ml-test/' + name, data)
+
+    for directory in (str(gz_dir), str(archive)):
+        for _ in range(2):
+            dataset = MovieLensDataset(directory, cache=True)
+            for args in (['top', '2'], ['imdb', 'Jumanji (1995)'], ['tag', 'pix'], ['stats']):
+                assert run_command(dataset, args) == run_command(plain, args)
+    assert (gz_dir / 'ratings.csv.gz.snapshot').exists()
+    assert (tmp_path / 'ml-test.zip.ml-test.ratings.csv.snapshot').exists()
+    assert aggregate_ratings(str(gz_dir / 'ratings.csv')).get_count(1) == 2
+    assert len(Ratings(str(archive / 'ratings.csv'), plain.movies, workers=2)) == 3
+
+    (tmp_path / 'ratings.csv.zst').write_bytes(b'')
+    try:
+        import zstandard
+    except ImportError:
+        with pytest.raises(Exception, match='zstandard'):
+            Ratings(str(tmp_path / 'ratings.csv.zst'), plain.movies)
+    with pytest.raises(Exception, match='Failed to load ratings'):
+        Ratings(str(archive / 'missing.csv'), plain.movies)
+
+def test_snapshot_cache(tmp_path):
+    movies_path = tmp_path / 'movies.csv'
+    ratings_path = tmp_path / 'ratings.csv'
+    movies_path.write_text(TEST_MOVIES_DATA, encoding='utf-8')
+    ratings_path.write_text(TEST_RATINGS_DATA, encoding='utf-8')
+    
+    movies = Movies(str(movies_path), cache=True)
+    ratings = Ratings(str(ratings_path), movies, cache=True)
+    assert os.path.exists(str(ratings_path) + '.snapshot')
+    
+    cached_movies = Movies(str(movies_path), cache=True)
+    cached = Ratings(str(ratings_path), cached_movies, cache=True)
+    assert isinstance(cached.values, memoryview)
+    assert cached_movies.get_movie(2) == movies.get_movie(2)
+    assert sum(record is not None for record in cached_movies.movies.records) == 1
+    assert cached.get_user_profiles([1, 2]) == ratings.get_user_profiles([1, 2])
+    assert cached_movies.get_movies() == movies.get_movies()
+    assert cached_movies.get_movie_by_title('jumanji (1995)') == movies.get_movie_by_title('Jumanji (1995)')
+    assert cached_movies.get_year_range() == movies.get_year_range() and cached_movies.get_genres() == movies.get_genres()
+    assert cached.get_ratings() == ratings.get_ratings()
+    assert cached.top_by_ratings(2) == ratings.top_by_ratings(2)
+
+    tags_path, links_path = tmp_path / 'tags.csv', tmp_path / 'links.csv'
+    tags_path.write_text(TEST_TAGS_DATA + '\n4,1,"naïve, ""quoted""",1147880046', encoding='utf-8')
+    links_path.write_text(TEST_LINKS_DATA, encoding='utf-8')
+    tags, links = Tags(str(tags_path), movies, cache=True), Links(str(links_path), movies, cache=True)
+    cached_tags = Tags(str(tags_path), cached_movies, cache=True)
+    cached_links = Links(str(links_path), cached_movies, cache=True)
+    assert cached_tags.get_movie_tags(1) == tags.get_movie_tags(1)
+    assert sum(record is not None for record in cached_tags.tags.records) == 3
+    assert cached_tags.get_tags() == tags.get_tags() and cached_tags.rejected == tags.rejected
+    assert cached_tags.get_tags_by_title('Toy Story (1995)') == tags.get_tags_by_title('Toy Story (1995)')
+    assert cached_tags.search_tags('naïve') == [(1, 1)]
+    assert cached_tags.append([(5, 1, 'classic', 1147880047)]) == 1
+    assert [t.tag for t in cached_tags.get_movie_tags(1)] == ['pixar', 'animation', 'naïve, "quoted"', 'classic']
+    assert cached_links.get_movie_links(2) == links.get_movie_links(2)
+    assert cached_links.get_links_by_titles(['Jumanji (1995)']) == links.get_links_by_titles(['Jumanji (1995)'])
+    
+    ratings_path.write_text(TEST_RATINGS_DATA + "\n3,3,1.0,1147880045", encoding='utf-8')
+    rebuilt = Ratings(str(ratings_path), cached_movies, cache=True)
+    assert isinstance(rebuilt.values, array)
+    assert len(rebuilt) == 4
+    assert len(Ratings(str(ratings_path), cached_movies, cache=True)) == 4
+
+def test_tag_index(setup_classes):
+    movies, _, tags, _ = setup_classes
+    
+    assert tags.search_tags('ANIM') == [(1, 1)]
+    assert tags.search_tags('a') == [(1, 2), (2, 1)]
+    assert tags.search_tags('nimatio') == [(1, 1)]
+    assert tags.search_tags('fan', mode='prefix') == [(2, 1)]
+    assert tags.search_tags('fan', mode='exact') == []
+    assert tags.search_tags('pixar animation') == [(1, 1)]
+    assert tags.search_tags('pixar fantasy') == []
+    
+    tags._add_tag(4, 2, 'Pixar', 1147880045)
+    tags._add_tag(5, 2, 'pixar, sequel', 1147880046)
+    assert tags.search_tags('pix') == [(2, 2), (1, 1)]
+    assert tags.search_tags('pix', limit=1) == [(2, 2)]
+    assert tags.get_tag_index().terms == sorted(tags.get_tag_index().postings)
+    
+    for user_id in (6, 7):
+        tags._add_tag(user_id, 3, 'dark comedy', 1147880047)
+    tags._add_tag(8, 3, 'sci-fi', 1147880048)
+    assert tags.search_tags('dark comedy') == tags.search_tags('dark') == [(3, 2)]
+    assert tags.search_tags('sci-fi') == [(3, 1)]
+
+def test_records(setup_classes):
+    movies, _, tags, _ = setup_classes
+    
+    movie = movies.get_movie('1')
+    assert not hasattr(movie, '__dict__')
+    assert movie.get('missing') is None
+    with pytest.raises(KeyError):
+        movie['missing']
+    assert movie._asdict()['title'] == 'Toy Story (1995)'
+    assert movies.get_movie(2).genres[0] is movie.genres[0]
+    assert movies.genre_mask(['Comedy', 'Romance']) == movies.get_movie(3).genre_mask
+    assert movies.genre_mask('Western') is None
+    assert repr(tags.get_movie_tags(2)[0]) == "Tag(userId=3, movieId=2, tag='fantasy', timestamp=1147880044)"
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    for name, content in [('movies.csv', TEST_MOVIES_DATA), ('ratings.csv', TEST_RATINGS_DATA),
+                          ('tags.csv', TEST_TAGS_DATA), ('links.csv', TEST_LINKS_DATA)]:
+        (tmp_path / name).write_text(content, encoding='utf-8')
+    return str(tmp_path)
+
+def test_run_command(dataset_dir):
+    dataset = MovieLensDataset(dataset_dir, cache=False)
+    
+    assert run_command(dataset, ['top', '1']) == (['Toy Story (1995) - mean: 4.75'], 0)
+    assert run_command(dataset, ['imdb', 'jumanji (1995)']) == (['IMDB: https://www.imdb.com/title/tt0113497/'], 0)
+    assert run_command(dataset, ['movie', '42']) == (['Movie not found'], 1)
+    assert run_command(dataset, ['window', '1', '2006-05']) == (['Toy Story (1995) in 2006-05: 2 ratings, mean: 4.75, median: 4.75',
+                                                                 '2006-05: 2 ratings, mean: 4.75'], 0)
+    assert run_command(dataset, ['trending', '1', 'delta'])[0] == ['Toy Story (1995) - delta: 2.00']
+    assert run_command(dataset, ['filter', 'genre=Adventure', 'min_rating=4']) == (['Toy Story (1995) - mean: 4.75'], 0)
+    assert run_command(dataset, ['filter', 'genre=Comedy', 'sort=none'])[0] == ['Toy Story (1995)', 'Grumpier Old Men (1995)']
+    assert run_command(dataset, ['nope']) == (['Unknown command'], 1)
+    assert run_command(dataset, [])[1] == 1
+    dataset.get_sketches()
+    dataset.get_similarity()
+    assert sorted(os.listdir(dataset_dir)) == ['links.csv', 'movies.csv', 'ratings.csv', 'tags.csv']
+    assert run_stream_command(dataset_dir, ['top', '1']) == run_command(dataset, ['top', '1'])
+
+def test_profiling(dataset_dir):
+    profiler = start_profiling()
+    try:
+        dataset = MovieLensDataset(dataset_dir, cache=False)
+        dataset.ratings.top_by_ratings(1)
+        dataset.ratings.top_by_ratings(1)
+        dataset.movies.get_movie(1)
+        dataset.tags.search_tags('funny')
+    finally:
+        assert stop_profiling() is profiler
+    assert profiler.counters['Ratings.rows'] == 3 and profiler.counters['Ratings.skipped'] == 0
+    assert profiler.phases['Ratings.parse'][0] == 1 and 'Ratings.index' in profiler.phases
+    assert sum(profiler.latencies['Ratings.top_by_ratings']) == 2
+    assert sum(profiler.latencies['Movies.get_movie']) == 1 and sum(profiler.latencies['Tags.search_tags']) == 1
+    assert any(line.startswith('Ratings MB/s') for line in profiler.summary())
+    dataset.ratings.top_by_ratings(2)
+    assert sum(profiler.latencies['Ratings.top_by_ratings']) == 2
+
+def test_server(dataset_dir, tmp_path):
+    dataset = MovieLensDataset(dataset_dir, cache=False)
+    export_path = str(tmp_path / 'export.csv')
+    
+    async def scenario():
+        server = await start_server(dataset, '127.0.0.1:0')
+        address = '127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+        async with server:
+            queries = [loop.run_in_executor(None, query_server, ['years'], address, dataset_dir) for _ in range(4)]
+            queries.append(loop.run_in_executor(None, query_server, ['years'], address, dataset_dir + '-other'))
+            results = await asyncio.gather(*queries)
+            with pytest.raises(Exception, match='only available from the command line'):
+                await loop.run_in_executor(None, query_server, ['export', export_path], address, dataset_dir)
+            return results
+    
+    assert asyncio.run(scenario()) == [(['Years: 1995 - 1995'], 0)] * 4 + [None]
+    assert not os.path.exists(export_path)
+    assert query_server(['years'], '127.0.0.1:1') is None
+    with socket.socket() as silent:
+        silent.bind(('127.0.0.1', 0))
+        silent.listen()
+        start = time.perf_counter()
+        assert query_server(['years'], '127.0.0.1:%d' % silent.getsockname()[1], dataset_dir) is None
+        assert time.perf_counter() - start < 2
+
+def test_error_handling(setup_classes):
+    movies, ratings, tags, links = setup_classes
+    
+    assert movies.get_movie("invalid") is None
+    assert movies.get_movie_by_title("invalid") is None
+    assert movies.get_movies_by_year("invalid") == []
+    assert movies.get_movies_by_genre("invalid") == []
+    assert ratings.get_movie_ratings("invalid") == []
+    assert tags.get_movie_tags("invalid") == []
+    assert links.get_movie_links("invalid") is None
+    assert tags.get_tags_by_title("invalid") == []